@@ -0,0 +1,149 @@
+import argparse
+import asyncio
+import gzip
+import logging
+import sys
+from os import getenv
+from time import perf_counter
+from typing import AsyncIterator, BinaryIO
+
+from dotenv import load_dotenv
+
+CHUNK = 1 << 20
+
+
+class Progress:
+    def __init__(self, action: str):
+        self.action = action
+        self.bytes = 0
+        self.start = perf_counter()
+        self._shown = 0.0
+
+    def add(self, size: int):
+        self.bytes += size
+        now = perf_counter()
+        if now - self._shown >= 1:
+            self._shown = now
+            print(f"\r{self.action}: {self._rate()}", end="", file=sys.stderr)
+
+    def _rate(self) -> str:
+        elapsed = max(perf_counter() - self.start, 1e-9)
+        mib = self.bytes / 2**20
+        return f"{mib:.1f} MiB, {mib / elapsed:.1f} MiB/s"
+
+    def done(self, rows: int):
+        elapsed = max(perf_counter() - self.start, 1e-9)
+        print(
+            f"\r{self.action}: {rows} rows in {elapsed:.2f}s"
+            f" ({rows / elapsed:.0f} rows/s, {self._rate()})",
+            file=sys.stderr,
+        )
+
+
+def open_dump(path: str, mode: str) -> BinaryIO:
+    # dumps are binary COPY streams, optionally gzipped
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def read_ids(values: list[str]) -> list[int]:
+    if values == ["-"]:
+        values = sys.stdin.read().split()
+    return [int(value) for value in values]
+
+
+async def export(store, args) -> int:
+    progress = Progress("export")
+    with open_dump(args.path, "wb") as f:
+
+        async def write(chunk: bytes):
+            f.write(chunk)
+            progress.add(len(chunk))
+
+        rows = await store.export_configs(write)
+    progress.done(rows)
+    return rows
+
+
+async def import_(store, args) -> int:
+    progress = Progress("import")
+
+    async def read() -> AsyncIterator[bytes]:
+        with open_dump(args.path, "rb") as f:
+            while chunk := f.read(CHUNK):
+                progress.add(len(chunk))
+                yield chunk
+
+    rows = await store.import_configs(read(), replace=args.replace)
+    progress.done(rows)
+    return rows
+
+
+async def run(args):
+    from bot.db import ConfigStore
+
+    store = ConfigStore(getenv("DATABASE_URL"), max_size=2)
+    await store.start()
+    try:
+        if args.command == "export":
+            await export(store, args)
+        elif args.command == "import":
+            await import_(store, args)
+        else:
+            start = perf_counter()
+            if args.command == "add-region":
+                rows = await store.add_region_many(read_ids(args.guilds), args.region)
+            elif args.command == "remove-region":
+                rows = await store.remove_region_many(
+                    read_ids(args.guilds), args.region
+                )
+            elif args.command == "delete":
+                rows = await store.delete_many(read_ids(args.guilds))
+            else:
+                rows = len(await store.prune([], [], args.days * 86400))
+                await store.notify_changed()
+            print(
+                f"{args.command}: {rows} rows in {perf_counter() - start:.2f}s",
+                file=sys.stderr,
+            )
+    finally:
+        await store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="bulk operations on guild configs",
+        epilog="Writes are safe while the bot runs: they NOTIFY configs_changed,"
+        " and a bot running with CONFIG_INDEX reloads its index when it gets"
+        " the notification.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    command = commands.add_parser("export", help="dump every config")
+    command.add_argument("path", help="output file, gzipped if it ends with .gz")
+    command = commands.add_parser("import", help="load a dump made by export")
+    command.add_argument("path")
+    command.add_argument(
+        "--replace", action="store_true", help="delete configs missing from the dump"
+    )
+    for name in ("add-region", "remove-region"):
+        command = commands.add_parser(
+            name, help=f"{name.replace('-', ' ')} for many guilds at once"
+        )
+        command.add_argument("region", type=int)
+        command.add_argument("guilds", nargs="+", help="guild ids, - reads stdin")
+    command = commands.add_parser("delete", help="delete many configs at once")
+    command.add_argument("guilds", nargs="+", help="guild ids, - reads stdin")
+    command = commands.add_parser(
+        "sweep", help="delete configs undeliverable for a number of days"
+    )
+    command.add_argument("days", type=float)
+    args = parser.parse_args()
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
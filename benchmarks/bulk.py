@@ -0,0 +1,78 @@
+"""Compare row-at-a-time config writes with the bulk ConfigStore API.
+
+Usage: DATABASE_URL=postgres://... python -m benchmarks.bulk [guilds]
+
+Runs ConfigStore against a scratch schema which is dropped afterwards.
+Times set() per guild against set_many(), add_region() per guild against
+add_region_many(), and an export_configs/import_configs round trip.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+from os import getenv
+from time import perf_counter
+
+import asyncpg
+
+SCHEMA = "bench_bulk"
+
+
+def report(name: str, rows: int, elapsed: float):
+    print(f"{name:24} {rows:>8} rows {elapsed:8.2f}s {rows / elapsed:10.0f} rows/s")
+
+
+async def main(guilds: int):
+    os.environ.setdefault("STORAGE_CHANNEL", "0")
+    from bot.db import ConfigStore
+
+    from .fakes import make_configs
+
+    conn = await asyncpg.connect(getenv("DATABASE_URL"))
+    await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    await conn.execute(f"CREATE SCHEMA {SCHEMA}")
+    store = ConfigStore(getenv("DATABASE_URL"), server_settings={"search_path": SCHEMA})
+    try:
+        await store.start()
+        configs = list(make_configs(guilds).values())
+        ids = [c.guild_id for c in configs]
+
+        start = perf_counter()
+        for c in configs:
+            await store.set(c.guild_id, c.channel_id, c.text_begin, c.text_end)
+        report("set", guilds, perf_counter() - start)
+        await store.delete_many(ids)
+        start = perf_counter()
+        await store.set_many(configs)
+        report("set_many", guilds, perf_counter() - start)
+
+        start = perf_counter()
+        for guild_id in ids:
+            await store.add_region(guild_id, 26)
+        report("add_region", guilds, perf_counter() - start)
+        start = perf_counter()
+        rows = await store.add_region_many(ids, 27)
+        report("add_region_many", rows, perf_counter() - start)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "configs.bin")
+            start = perf_counter()
+            rows = await store.export_configs(path)
+            report("export_configs", rows, perf_counter() - start)
+            print(f"dump size: {os.path.getsize(path) / 2**20:.1f} MiB")
+            start = perf_counter()
+            rows = await store.import_configs(path, replace=True)
+            report("import_configs", rows, perf_counter() - start)
+
+        start = perf_counter()
+        rows = await store.delete_many(ids)
+        report("delete_many", rows, perf_counter() - start)
+    finally:
+        await store.close()
+        await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000))
@@ -0,0 +1,133 @@
+"""Compare memory and get_for cost of the in-memory config index.
+
+Usage: python -m benchmarks.config_memory [guilds]
+
+Rows are built the way asyncpg returns them: every row gets its own
+string objects, even when many guilds share a template. "tuples" is the
+previous representation (a 4-tuple per guild, 3-tuples in the region
+index, a new list per get_for). "GuildConfig" is ConfigStore's index.
+"""
+
+import asyncio
+import gc
+import os
+import random
+import sys
+import tracemalloc
+from statistics import median
+from time import perf_counter
+
+REGIONS = range(1, 26)
+TEMPLATES = (
+    ("Повітряна тривога в %name%!", "Відбій тривоги в %name%."),
+    ("🔴 %name%: тривога! %map%", "🟢 %name%: відбій. %map%"),
+    ("%name_en% air raid alert", "%name_en% all clear"),
+)
+ROUNDS = 50
+
+
+def make_rows(guilds: int, seed: int = 0) -> list[tuple]:
+    rng = random.Random(seed)
+    rows = []
+    for i in range(guilds):
+        if rng.random() < 0.8:
+            begin, end = rng.choice(TEMPLATES)
+        else:
+            begin, end = f"Custom alert {i} %name%", f"Custom all clear {i} %name%"
+        regions = [] if rng.random() < 0.5 else rng.sample(REGIONS, rng.randint(1, 3))
+        # fresh copies, as decoded from the wire
+        rows.append(
+            (
+                (rng.getrandbits(40) << 22) | i,
+                rng.getrandbits(62),
+                "".join(list(begin)),
+                "".join(list(end)),
+                regions,
+            )
+        )
+    return rows
+
+
+class TupleIndex:
+    def __init__(self, rows: list[tuple]):
+        self.configs = {}
+        self.index = {}
+        for guild_id, channel_id, begin, end, regions in rows:
+            config = (channel_id, begin, end, regions)
+            self.configs[guild_id] = config
+            for region_id in regions or (None,):
+                self.index.setdefault(region_id, {})[guild_id] = config[:3]
+
+    def get_for(self, region_id: int) -> list:
+        return [
+            *self.index.get(None, {}).values(),
+            *self.index.get(region_id, {}).values(),
+        ]
+
+
+def build_store(rows: list[tuple]):
+    from bot.db import ConfigStore, GuildConfig
+
+    store = ConfigStore(use_index=True)
+    store._configs = {}
+    for guild_id, channel_id, begin, end, regions in rows:
+        store._update_index(
+            guild_id, GuildConfig(guild_id, channel_id, begin, end, regions)
+        )
+    store._ready.set()
+    return store
+
+
+def measure(name: str, build, get_for, guilds: int):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    # rows are dropped once loaded, like asyncpg records are
+    index = build(make_rows(guilds))
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    # warm up, which also fills GuildConfig's per-region tuples
+    for region_id in REGIONS:
+        get_for(index, region_id)
+    warm = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    times = []
+    for _ in range(ROUNDS):
+        start = perf_counter()
+        for region_id in REGIONS:
+            for config in get_for(index, region_id):
+                pass
+        times.append((perf_counter() - start) / len(REGIONS))
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = get_for(index, REGIONS[0])
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del result
+    print(
+        f"{name:12} index {size / 2**20:5.1f} MiB, {warm / 2**20:5.1f} MiB warm"
+        f"  get_for {median(times) * 1000:6.2f} ms"
+        f"  allocated per event {allocated / 1024:8.1f} KiB"
+    )
+
+
+def main():
+    os.environ.setdefault("STORAGE_CHANNEL", "0")
+    import bot.db  # noqa: F401  keep import costs out of the measurement
+
+    guilds = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    print(f"{guilds} guilds")
+    measure("tuples", TupleIndex, TupleIndex.get_for, guilds)
+    loop = asyncio.new_event_loop()
+    measure(
+        "GuildConfig",
+        build_store,
+        lambda store, region_id: loop.run_until_complete(store.get_for(region_id)),
+        guilds,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+"""Offline stand-ins for Discord and PostgreSQL used by the harnesses."""
+
+import asyncio
+import json
+import random
+from datetime import datetime, timezone
+from itertools import count
+from time import monotonic, time
+from types import SimpleNamespace
+from typing import Optional
+
+import discord
+
+from bot.db import ConfigStore, GuildConfig
+
+REGIONS = range(1, 26)
+_message_ids = count(1)
+
+
+def make_configs(
+    guilds: int,
+    template: str = "%name%",
+    seed: int = 0,
+    webhooks: float = 0.0,
+    digests: float = 0.0,
+) -> dict[int, GuildConfig]:
+    # snowflake-like ids so that (guild_id >> 22) spreads guilds over shards
+    rng = random.Random(seed)
+    configs = {}
+    for i in range(guilds):
+        guild_id = (rng.getrandbits(40) << 22) | i
+        regions = [] if rng.random() < 0.5 else rng.sample(REGIONS, rng.randint(1, 3))
+        webhook = (guild_id + 2, f"token{i}") if rng.random() < webhooks else ()
+        configs[guild_id] = GuildConfig(
+            guild_id, guild_id + 1, template, template, regions, *webhook
+        )
+        configs[guild_id].digest = rng.random() < digests
+    return configs
+
+
+class MemoryConfigStore(ConfigStore):
+    def __init__(self, configs: dict[int, GuildConfig], **kwargs):
+        super().__init__(use_index=True, **kwargs)
+        self.configs = configs
+        # guild_id -> time it was first marked ineligible
+        self.ineligible_since: dict[int, float] = {}
+
+    async def start(self):
+        self._configs = {}
+        self._index = {}
+        self._subscribers = {}
+        for guild_id, config in self.configs.items():
+            self._update_index(guild_id, config)
+        self._ready.set()
+
+    async def close(self):
+        pass
+
+    async def _run(self, method: str, query: str, *args):
+        await self._ready.wait()
+        if query == "notify":
+            return None
+        if query == "get_for":
+            region_id = args[0]
+            return [
+                dict(
+                    guild_id=c.guild_id,
+                    channel_id=c.channel_id,
+                    text_begin=c.text_begin,
+                    text_end=c.text_end,
+                    webhook_id=c.webhook_id,
+                    webhook_token=c.webhook_token,
+                    digest=c.digest,
+                )
+                for c in self.configs.values()
+                if self.owns(c.guild_id)
+                and (not c.region_mask or region_id in c.regions)
+            ]
+        if query == "get_channels":
+            return [
+                dict(
+                    guild_id=c.guild_id,
+                    channel_id=c.channel_id,
+                    webhook_id=c.webhook_id,
+                )
+                for c in self.configs.values()
+                if self.owns(c.guild_id)
+            ]
+        if query == "mark_ineligible":
+            for guild_id in args[0]:
+                self.ineligible_since.setdefault(guild_id, time())
+            return []
+        if query == "mark_eligible":
+            for guild_id in args[0]:
+                self.ineligible_since.pop(guild_id, None)
+            return []
+        if query == "prune":
+            pruned = [
+                guild_id
+                for guild_id, since in self.ineligible_since.items()
+                if since < time() - args[0] and self.owns(guild_id)
+            ]
+            for guild_id in pruned:
+                self.configs.pop(guild_id, None)
+                del self.ineligible_since[guild_id]
+            return [dict(guild_id=guild_id) for guild_id in pruned]
+        if query in ("add_region_many", "remove_region_many"):
+            guild_ids, region_id = args
+            rows = []
+            for guild_id in guild_ids:
+                config = self.configs.get(guild_id)
+                if not config or (region_id in config.regions) == (
+                    query == "add_region_many"
+                ):
+                    continue
+                if query == "add_region_many":
+                    regions = [*config.regions, region_id]
+                else:
+                    regions = [r for r in config.regions if r != region_id]
+                self.configs[guild_id] = config.with_regions(regions)
+                rows.append(dict(guild_id=guild_id, regions=regions))
+            return rows
+        if query == "delete_many":
+            deleted = [g for g in args[0] if self.configs.pop(g, None) is not None]
+            for guild_id in deleted:
+                self.ineligible_since.pop(guild_id, None)
+            return [dict(guild_id=guild_id) for guild_id in deleted]
+        guild_id, *args = args
+        config = self.configs.get(guild_id)
+        if query == "set":
+            regions = config.regions if config else []
+            channel_id, text_begin, text_end, *extra = args
+            self.configs[guild_id] = GuildConfig(
+                guild_id, channel_id, text_begin, text_end, regions, *extra
+            )
+            self.ineligible_since.pop(guild_id, None)
+            return regions
+        if query == "get":
+            return config and dict(
+                channel_id=config.channel_id,
+                text_begin=config.text_begin,
+                text_end=config.text_end,
+                regions=config.regions,
+                webhook_id=config.webhook_id,
+                webhook_token=config.webhook_token,
+                digest=config.digest,
+            )
+        if query == "delete":
+            self.configs.pop(guild_id, None)
+            self.ineligible_since.pop(guild_id, None)
+            return []
+        if query in ("add_region", "remove_region"):
+            if not config or (args[0] in config.regions) == (query == "add_region"):
+                return None
+            if query == "add_region":
+                regions = [*config.regions, args[0]]
+            else:
+                regions = [r for r in config.regions if r != args[0]]
+            self.configs[guild_id] = config.with_regions(regions)
+            return regions
+        if query == "remove_all_regions":
+            if config:
+                self.configs[guild_id] = config.with_regions([])
+            return []
+        if query == "clear_webhook":
+            if not config or config.webhook_id != args[0]:
+                return None
+            self.configs[guild_id] = GuildConfig(
+                guild_id,
+                config.channel_id,
+                config.text_begin,
+                config.text_end,
+                config.regions,
+                digest=config.digest,
+            )
+            return config.regions
+        raise NotImplementedError(query)
+
+
+class FakeResponse:
+    def __init__(self, status: int, reason: str = ""):
+        self.status = status
+        self.reason = reason
+
+
+class FakeHTTP:
+    """Simulated Discord REST latency with occasional 429 responses."""
+
+    def __init__(self, latency: float = 0.05, rate_limit: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.rate_limited = 0
+        self.active = 0
+
+    async def request(self):
+        # py-cord sleeps and retries on 429 by itself, so the caller only
+        # observes the added latency
+        self.active += 1
+        try:
+            while True:
+                self.requests += 1
+                await asyncio.sleep(self.latency * self.rng.uniform(0.5, 1.5))
+                if self.rng.random() >= self.rate_limit:
+                    return
+                self.rate_limited += 1
+                await asyncio.sleep(self.rng.uniform(0.1, 1.0))
+        finally:
+            self.active -= 1
+
+
+class FakeMessage:
+    def __init__(self, channel: "FakeChannel", content: str, embed):
+        self.id = next(_message_ids)
+        self.channel = channel
+        self.content = content
+        self.embed = embed
+        self.created = monotonic()
+
+    async def edit(self, content: Optional[str] = None, embed=None):
+        await self.channel.http.request()
+        self.content = content
+        self.embed = embed
+        return self
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int, guild, http: FakeHTTP, deliveries: list):
+        self.id = channel_id
+        self.guild = guild
+        self.http = http
+        self.deliveries = deliveries
+
+    def permissions_for(self, member):
+        return SimpleNamespace(send_messages=True, embed_links=True)
+
+    def get_partial_message(self, message_id: int):
+        message = FakeMessage(self, "", None)
+        message.id = message_id
+        return message
+
+    async def send(self, content: str = None, embed: discord.Embed = None, **kwargs):
+        await self.http.request()
+        message = FakeMessage(self, content, embed)
+        self.deliveries.append((self.guild.id, message))
+        return message
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.unavailable = False
+        self.me = SimpleNamespace(timed_out=False, communication_disabled_until=None)
+        self.channels: dict[int, FakeChannel] = {}
+
+    def get_channel(self, channel_id: int):
+        return self.channels.get(channel_id)
+
+
+class FakeGateway:
+    """Resolves channels and guilds like discord.Bot does from its cache."""
+
+    def __init__(self, configs: dict[int, GuildConfig], http: FakeHTTP):
+        self.http = http
+        self.deliveries: list[tuple[int, FakeMessage]] = []
+        self.guilds: dict[int, FakeGuild] = {}
+        self.channels: dict[int, FakeChannel] = {}
+        for guild_id, config in configs.items():
+            guild = self.guilds[guild_id] = FakeGuild(guild_id)
+            channel = FakeChannel(config.channel_id, guild, http, self.deliveries)
+            guild.channels[channel.id] = self.channels[channel.id] = channel
+
+    def get_guild(self, guild_id: int):
+        return self.guilds.get(guild_id)
+
+    def get_channel(self, channel_id: int):
+        return self.channels.get(channel_id)
+
+    def get_partial_messageable(self, channel_id: int):
+        return self.channels[channel_id]
+
+
+class FakeWebhookServer:
+    """Local stand-in for Discord's webhook endpoints.
+
+    Point discord.http.Route.base at `base` to route py-cord's webhook
+    requests here. 429s carry the Via header so that py-cord retries them
+    the way it does for responses coming from Discord.
+    """
+
+    def __init__(
+        self,
+        deliveries: list,
+        latency: float = 0.05,
+        rate_limit: float = 0.0,
+        seed: int = 0,
+    ):
+        self.deliveries = deliveries
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.rate_limited = 0
+        self.base = ""
+        self._runner = None
+
+    async def start(self):
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_post("/webhooks/{id}/{token}", self.execute)
+        app.router.add_patch("/webhooks/{id}/{token}/messages/{message}", self.edit)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.base = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+    async def close(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    @staticmethod
+    def _json(data: dict, status: int = 200, **headers):
+        from aiohttp import web
+
+        # py-cord only decodes an exact application/json content type
+        headers["Content-Type"] = "application/json"
+        return web.Response(
+            body=json.dumps(data).encode(), status=status, headers=headers
+        )
+
+    async def _respond(self, request, message_id: int):
+        self.requests += 1
+        await asyncio.sleep(self.latency * self.rng.uniform(0.5, 1.5))
+        if self.rng.random() < self.rate_limit:
+            self.rate_limited += 1
+            return self._json(
+                {"retry_after": self.rng.uniform(0.1, 1.0), "global": False},
+                429,
+                Via="1.1 google",
+            )
+        payload = await request.json()
+        webhook_id = request.match_info["id"]
+        return self._json(
+            {
+                "id": str(message_id),
+                "channel_id": str(int(webhook_id) - 1),
+                "webhook_id": webhook_id,
+                "author": {
+                    "id": webhook_id,
+                    "username": "webhook",
+                    "discriminator": "0000",
+                    "avatar": None,
+                },
+                "content": payload.get("content") or "",
+                "embeds": payload.get("embeds", []),
+                "attachments": [],
+                "mentions": [],
+                "mention_roles": [],
+                "mention_everyone": False,
+                "pinned": False,
+                "tts": False,
+                "type": 0,
+                "flags": 0,
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "edited_timestamp": None,
+            }
+        )
+
+    async def execute(self, request):
+        message = FakeMessage(None, "", None)
+        response = await self._respond(request, message.id)
+        if response.status == 200:
+            message.content = json.loads(response.body)["content"]
+            message.created = monotonic()
+            self.deliveries.append((int(request.match_info["id"]) - 2, message))
+        return response
+
+    async def edit(self, request):
+        return await self._respond(request, int(request.match_info["message"]))
@@ -0,0 +1,99 @@
+"""Compare ConfigStore.get_for latency on the legacy and the current schema.
+
+Usage: DATABASE_URL=postgres://... python -m benchmarks.get_for [guilds ...]
+
+Tables are created in a scratch schema which is dropped afterwards. The
+current schema is built by db.migrate() and timed with the shipped
+get_for statement, for a single shard.
+"""
+
+import asyncio
+import os
+import random
+import sys
+from os import getenv
+from statistics import median, quantiles
+from time import perf_counter
+
+import asyncpg
+
+SCHEMA = "bench_get_for"
+REGIONS = range(1, 26)
+ROUNDS = 20
+
+# the schema and query before the migrations, as the baseline
+LEGACY_GET_FOR = """
+SELECT channel_id, text_begin, text_end FROM configs
+WHERE
+    array_length(regions, 1) IS NULL
+    OR array_position(regions, $1) IS NOT NULL
+"""
+
+
+async def legacy_schema(conn: asyncpg.Connection):
+    from bot.db import MIGRATIONS
+
+    await conn.execute(MIGRATIONS[0])
+
+
+def make_rows(count: int):
+    rng = random.Random(count)
+    for i in range(count):
+        guild_id = (1 << 50) + i
+        regions = [] if rng.random() < 0.3 else rng.sample(REGIONS, rng.randint(1, 3))
+        yield guild_id, guild_id + 1, "%name%", "%name% end", regions
+
+
+async def measure(conn: asyncpg.Connection, create, query: str, rows, convert, *args):
+    await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    await conn.execute(f"CREATE SCHEMA {SCHEMA}")
+    await conn.execute(f"SET search_path TO {SCHEMA}")
+    await create(conn)
+    # same table name as the previous run, but different column types
+    await conn.reload_schema_state()
+    await conn.copy_records_to_table(
+        "configs",
+        records=[convert(row) for row in rows],
+        columns=("guild_id", "channel_id", "text_begin", "text_end", "regions"),
+        schema_name=SCHEMA,
+    )
+    await conn.execute("ANALYZE configs")
+    stmt = await conn.prepare(query)
+    timings = []
+    for _ in range(ROUNDS):
+        for region_id in REGIONS:
+            start = perf_counter()
+            await stmt.fetch(region_id, *args)
+            timings.append((perf_counter() - start) * 1000)
+    return median(timings), quantiles(timings, n=100)[98]
+
+
+async def main(sizes: list[int]):
+    os.environ.setdefault("STORAGE_CHANNEL", "0")
+    from bot.db import QUERIES, migrate
+
+    conn = await asyncpg.connect(getenv("DATABASE_URL"))
+    try:
+        for size in sizes:
+            rows = list(make_rows(size))
+            legacy = await measure(
+                conn,
+                legacy_schema,
+                LEGACY_GET_FOR,
+                rows,
+                lambda r: (str(r[0]), str(r[1]), r[2], r[3], r[4] or None),
+            )
+            current = await measure(
+                conn, migrate, QUERIES["get_for"], rows, tuple, 1, [0]
+            )
+            for name, (p50, p99) in (("legacy", legacy), ("current", current)):
+                print(
+                    f"{size:>7} guilds {name:>8}: p50 {p50:7.2f} ms  p99 {p99:7.2f} ms"
+                )
+    finally:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main([int(n) for n in sys.argv[1:]] or [10_000, 100_000]))
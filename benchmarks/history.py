@@ -0,0 +1,75 @@
+"""Measure the alert history log: append, replay on restart, queries, compaction.
+
+Usage: python -m benchmarks.history [records]
+
+Writes a synthetic log of alternating alert/all-clear transitions for 25
+regions to a temporary file, then times loading it back, /status and
+/history lookups, and compacting away the older half.
+"""
+
+import os
+import random
+import sys
+import tempfile
+from statistics import median
+from time import perf_counter, time
+
+REGIONS = range(1, 26)
+ROUNDS = 1000
+
+
+def main():
+    os.environ.setdefault("STORAGE_CHANNEL", "0")
+    from bot.history import RECORD, AlertHistory
+
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    rng = random.Random(0)
+    # spaced so that the log spans about twice the retention period
+    step = 86400 / (records / 2)
+    now = time()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "history.bin")
+        history = AlertHistory(path, retention=86400)
+        start = perf_counter()
+        for i in range(records):
+            region_id = rng.choice(REGIONS)
+            state = history.states.get(region_id)
+            history.append(
+                region_id, not (state and state[0]), now - 2 * 86400 + i * step
+            )
+        append = perf_counter() - start
+        history.close()
+        size = os.path.getsize(path)
+        print(f"{len(history)} records, {size / 2**20:.1f} MiB ({RECORD.size} B each)")
+        print(f"append    {append / records * 1e6:8.2f} us/record")
+
+        start = perf_counter()
+        history = AlertHistory(path, retention=86400)
+        history.load()
+        print(f"load      {(perf_counter() - start) * 1000:8.1f} ms")
+
+        times = []
+        for _ in range(ROUNDS):
+            start = perf_counter()
+            history.active()
+            times.append(perf_counter() - start)
+        print(f"active    {median(times) * 1e6:8.2f} us")
+        times = []
+        for _ in range(ROUNDS):
+            region_id = rng.choice(REGIONS)
+            start = perf_counter()
+            history.history(region_id, now - 7 * 86400, limit=20)
+            times.append(perf_counter() - start)
+        print(f"history   {median(times) * 1e6:8.2f} us")
+
+        start = perf_counter()
+        history.compact()
+        print(
+            f"compact   {(perf_counter() - start) * 1000:8.1f} ms,"
+            f" {len(history)} records left"
+        )
+        history.close()
+
+
+if __name__ == "__main__":
+    main()
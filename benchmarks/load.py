@@ -0,0 +1,275 @@
+"""Push alert bursts through the whole pipeline without network access.
+
+Usage: python -m benchmarks.load [--guilds 2000] [--bursts 5] [--burst-size 10]
+           [--interval 1] [--latency 0.05] [--rate-limit 0.01] [--rate 1000]
+           [--replay capture.txt] [--trace-memory] [--webhooks 0.5]
+           [--digests 0.5]
+
+A local SSE server stands in for alerts.com.ua and feeds API.listen, so
+events go through the same parsing, coalescing and send_alarm path as in
+production. Discord is replaced by FakeGateway/FakeHTTP and PostgreSQL by
+MemoryConfigStore. Delivery latency is measured from the moment the server
+writes an event to the moment the fake channel accepts the message.
+
+--replay takes a raw capture of the states/live stream (e.g. saved with
+curl -N) and replays its update events in bursts instead of synthetic
+traffic. Discord's real global limit is about 50 requests per second;
+the default --rate is higher so that the harness measures the bot, not
+the limiter.
+
+--webhooks sets the fraction of guilds configured for webhook delivery.
+Their messages go through py-cord's webhook client to a local HTTP
+server (FakeWebhookServer) with the same latency and 429 rate.
+
+--digests sets the fraction of guilds in digest mode. A digest counts
+once per region it lists in the latency numbers.
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import random
+import resource
+import tracemalloc
+from bisect import bisect_right
+from collections import defaultdict
+from statistics import quantiles
+from time import monotonic
+
+import discord
+from aiohttp import web
+
+REGIONS = range(1, 26)
+
+
+def synthetic_bursts(bursts: int, size: int, seed: int = 0) -> list[list[dict]]:
+    rng = random.Random(seed)
+    alerts = dict.fromkeys(REGIONS, False)
+    result = []
+    for _ in range(bursts):
+        burst = []
+        for region_id in rng.sample(REGIONS, min(size, len(REGIONS))):
+            alerts[region_id] = not alerts[region_id]
+            burst.append(
+                {
+                    "id": region_id,
+                    "name": f"Region {region_id}",
+                    "name_en": f"Region {region_id}",
+                    "alert": alerts[region_id],
+                    "changed": "2022-03-15T00:00:00+02:00",
+                }
+            )
+        result.append(burst)
+    return result
+
+
+def recorded_bursts(path: str, size: int) -> list[list[dict]]:
+    states = []
+    with open(path, encoding="utf-8") as f:
+        for block in f.read().split("\n\n"):
+            fields = dict(
+                line.split(":", 1) for line in block.splitlines() if ":" in line
+            )
+            if fields.get("event", "").strip() == "update":
+                states.append(json.loads(fields["data"])["state"])
+    return [states[i : i + size] for i in range(0, len(states), size)]
+
+
+class SSEServer:
+    def __init__(self, bursts: list[list[dict]], interval: float):
+        self.bursts = bursts
+        self.interval = interval
+        # monotonic times each region's update was written
+        self.emitted: dict[int, list[float]] = defaultdict(list)
+        self.done = asyncio.Event()
+        self._started = False
+        self._runner = None
+        self._streams: set[asyncio.Task] = set()
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_get("/api/states/live", self._handle)
+        app.router.add_get("/api/states", self._states)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}/api"
+
+    async def close(self):
+        for task in self._streams:
+            task.cancel()
+        await self._runner.cleanup()
+
+    async def _states(self, request: web.Request) -> web.Response:
+        # what the bot reconciles against on connect: every region in the
+        # state before its first replayed update
+        initial = {}
+        for burst in self.bursts:
+            for state in burst:
+                initial.setdefault(state["id"], dict(state, alert=not state["alert"]))
+        return web.json_response({"states": list(initial.values())})
+
+    async def _handle(self, request: web.Request) -> web.StreamResponse:
+        response = web.StreamResponse(
+            headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"}
+        )
+        await response.prepare(request)
+        self._streams.add(asyncio.current_task())
+        # replay once; reconnects only get keep-alive pings
+        if not self._started:
+            self._started = True
+            for i, burst in enumerate(self.bursts):
+                if i:
+                    await asyncio.sleep(self.interval)
+                for state in burst:
+                    data = json.dumps({"state": state})
+                    await response.write(f"event: update\ndata: {data}\n\n".encode())
+                    self.emitted[state["id"]].append(monotonic())
+            self.done.set()
+        while True:
+            await asyncio.sleep(1)
+            await response.write(b"event: ping\ndata: {}\n\n")
+
+
+def latencies(server: SSEServer, deliveries: list, names: dict[str, int]) -> list:
+    result = []
+    for _, message in deliveries:
+        # digests list several regions
+        for name in message.content.split(", "):
+            emitted = server.emitted[names[name]]
+            i = bisect_right(emitted, message.created)
+            if i:
+                result.append(message.created - emitted[i - 1])
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--guilds", type=int, default=2000)
+    parser.add_argument("--bursts", type=int, default=5)
+    parser.add_argument("--burst-size", type=int, default=10)
+    parser.add_argument("--interval", type=float, default=1.0)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--rate-limit", type=float, default=0.01)
+    parser.add_argument("--rate", type=float, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--replay", default=None)
+    parser.add_argument("--trace-memory", action="store_true")
+    parser.add_argument("--webhooks", type=float, default=0.0)
+    parser.add_argument("--digests", type=float, default=0.0)
+    args = parser.parse_args()
+
+    os.environ.update(
+        STORAGE_CHANNEL="0",
+        API_KEY="load",
+        REGIONS_CACHE="",
+        DISPATCH_RATE=str(args.rate),
+        DISPATCH_CONCURRENCY=str(args.concurrency),
+        WEBHOOK_DISPATCH_RATE=str(args.rate),
+        WEBHOOK_DISPATCH_CONCURRENCY=str(args.concurrency),
+    )
+    if args.trace_memory:
+        tracemalloc.start()
+    module = importlib.import_module("bot.bot")
+    api_module = importlib.import_module("bot.api")
+    from bot.metrics import metrics
+
+    from .fakes import (
+        FakeGateway,
+        FakeHTTP,
+        FakeWebhookServer,
+        MemoryConfigStore,
+        make_configs,
+    )
+
+    if args.replay:
+        bursts = recorded_bursts(args.replay, args.burst_size)
+    else:
+        bursts = synthetic_bursts(args.bursts, args.burst_size)
+    names = {s["name"]: s["id"] for burst in bursts for s in burst}
+    configs = make_configs(args.guilds, webhooks=args.webhooks, digests=args.digests)
+    http = FakeHTTP(latency=args.latency, rate_limit=args.rate_limit)
+    gateway = FakeGateway(configs, http)
+    webhook_server = FakeWebhookServer(
+        gateway.deliveries, latency=args.latency, rate_limit=args.rate_limit
+    )
+    module.bot.get_guild = gateway.get_guild
+    module.store = MemoryConfigStore(configs)
+    metrics.enabled = True
+
+    def idle() -> bool:
+        return not (
+            module.api._pending
+            or module.api._queue.qsize()
+            or module.dispatcher.depth
+            or module.webhook_dispatcher.depth
+            or module.digests.pending
+            or http.active
+        )
+
+    async def run():
+        server = SSEServer(bursts, args.interval)
+        api_module.ENDPOINT = await server.start()
+        await webhook_server.start()
+        discord.http.Route.base = webhook_server.base
+        module.dispatcher.start()
+        module.webhook_dispatcher.start()
+        await module.store.start()
+        listener = asyncio.create_task(module.api.listen(module.send_alarm))
+        await server.done.wait()
+        while True:
+            await asyncio.sleep(0.1)
+            if idle():
+                await asyncio.sleep(0.1)
+                if idle():
+                    break
+        listener.cancel()
+        await module.digests.close()
+        await module.dispatcher.close()
+        await module.webhook_dispatcher.close()
+        await module.webhooks.close()
+        await asyncio.gather(listener, return_exceptions=True)
+        await server.close()
+        await webhook_server.close()
+        return server
+
+    server = module.bot.loop.run_until_complete(run())
+
+    delays = latencies(server, gateway.deliveries, names)
+    events = sum(map(len, bursts))
+    sent = len(gateway.deliveries)
+    first = min(min(times) for times in server.emitted.values())
+    last = max((m.created for _, m in gateway.deliveries), default=first)
+    elapsed = max(last - first, 1e-9)
+    print(f"{events} events, {args.guilds} guilds, {sent} messages in {elapsed:.2f}s")
+    print(f"throughput: {sent / elapsed:.0f} messages/s")
+    if len(delays) > 1:
+        cuts = quantiles(delays, n=100, method="inclusive")
+        print(
+            f"delivery latency: p50 {cuts[49] * 1000:.0f}ms, "
+            f"p99 {cuts[98] * 1000:.0f}ms, max {max(delays) * 1000:.0f}ms"
+        )
+    print(f"http: {http.requests} requests, {http.rate_limited} rate limited")
+    if args.webhooks:
+        print(
+            f"webhooks: {webhook_server.requests} requests,"
+            f" {webhook_server.rate_limited} rate limited"
+        )
+    for stage, summary in sorted(metrics.summary()["stages"].items()):
+        print(
+            f"  {stage:16} n={summary['count']:<7} avg {summary['avg'] * 1000:.1f}ms"
+            f" p99 <= {summary['p99'] * 1000:.0f}ms"
+        )
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"max rss: {rss:.1f} MiB")
+    if args.trace_memory:
+        current, peak = tracemalloc.get_traced_memory()
+        print(f"traced: {current / 2**20:.1f} MiB now, {peak / 2**20:.1f} MiB peak")
+
+
+if __name__ == "__main__":
+    main()
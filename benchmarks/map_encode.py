@@ -0,0 +1,58 @@
+"""Compare map encoding options by output size and encode time.
+
+Usage: python -m benchmarks.map_encode [map.png]
+
+Without an input image a synthetic map is rendered with the native
+renderer. Upload time scales with the size column, so the best option
+is the one with the lowest encode time plus expected upload time.
+"""
+
+import sys
+import tempfile
+from io import BytesIO
+from itertools import product
+from statistics import median
+from time import perf_counter
+
+from PIL import Image
+
+from map_render.optimize import Optimizer
+
+from .map_render import random_states, synthetic_svg
+
+RUNS = 5
+
+
+def load_image() -> Image.Image:
+    if len(sys.argv) > 1:
+        return Image.open(sys.argv[1]).convert("RGB")
+    from random import Random
+
+    from map_render.native import Geometry, NativeRenderer
+
+    with tempfile.NamedTemporaryFile(suffix=".svg") as f:
+        synthetic_svg(f.name)
+        renderer = NativeRenderer(Geometry.from_svg(f.name))
+    return Image.fromarray(renderer.draw(random_states(Random(0))))
+
+
+def main():
+    image = load_image()
+    f = BytesIO()
+    image.save(f, "PNG")
+    print(f"input {image.width}x{image.height}, plain png {len(f.getvalue())} bytes")
+    for fmt, colors, width in product(("png", "webp"), (None, 16, 8), (None, 800, 500)):
+        optimizer = Optimizer(fmt, width, colors)
+        timings = []
+        for _ in range(RUNS):
+            start = perf_counter()
+            data = optimizer.encode(image)
+            timings.append(perf_counter() - start)
+        print(
+            f"{fmt:>4} colors={colors or '-':>2} width={width or '-':>4}: "
+            f"{len(data):>8} bytes  {median(timings) * 1000:7.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Compare latency and memory of the map render backends.
+
+Usage: python -m benchmarks.map_render [--selenium] [--runs N]
+
+The native backend uses MAP_GEOMETRY when set, otherwise a synthetic
+geometry of 25 curved regions. No real oblast geometry ships with the
+bot, so results without MAP_GEOMETRY only approximate the real map. The Selenium backend needs Chrome and
+network access to alerts.in.ua, so it only runs with --selenium.
+"""
+
+import argparse
+import math
+import random
+import resource
+import tempfile
+import tracemalloc
+from os import getenv
+from statistics import median
+from time import perf_counter
+
+import numpy as np
+
+REGIONS = 25
+
+
+def synthetic_svg(path: str, regions: int = REGIONS, points: int = 60):
+    rng = random.Random(regions)
+    side = math.isqrt(regions - 1) + 1
+    cell = 100
+    paths = []
+    for region_id in range(1, regions + 1):
+        cx = ((region_id - 1) % side + 0.5) * cell
+        cy = ((region_id - 1) // side + 0.5) * cell
+        d = []
+        for i in range(points):
+            angle = 2 * math.pi * i / points
+            r = cell * rng.uniform(0.35, 0.5)
+            x, y = cx + r * math.cos(angle), cy + r * math.sin(angle)
+            if i == 0:
+                d.append(f"M{x:.2f},{y:.2f}")
+            else:
+                d.append(f"Q{x + rng.uniform(-3, 3):.2f},{y:.2f} {x:.2f},{y:.2f}")
+        paths.append(f'<path data-id="{region_id}" d="{" ".join(d)}Z"/>')
+    with open(path, "w") as f:
+        f.write(
+            '<svg xmlns="http://www.w3.org/2000/svg" '
+            f'viewBox="0 0 {side * cell} {side * cell}">{"".join(paths)}</svg>'
+        )
+
+
+def random_states(rng: random.Random) -> dict[int, bool]:
+    return {region_id: rng.random() < 0.4 for region_id in range(1, REGIONS + 1)}
+
+
+def report(name: str, timings: list[float], memory: str):
+    print(
+        f"{name:>12}: p50 {median(timings) * 1000:8.1f} ms  "
+        f"max {max(timings) * 1000:8.1f} ms  {memory}"
+    )
+
+
+def bench_native(runs: int, geometry: str):
+    from map_render.native import Geometry, NativeRenderer
+
+    tracemalloc.start()
+    renderer = NativeRenderer(Geometry.from_svg(geometry))
+    rng = random.Random(0)
+    states = random_states(rng)
+    start = perf_counter()
+    renderer.render(states)
+    print(
+        f"native setup (masks + first frame) {(perf_counter() - start) * 1000:.1f} ms"
+    )
+    for name, incremental in (("full", False), ("incremental", True)):
+        timings = []
+        for _ in range(runs):
+            # a single-region transition, as delivered by one SSE update
+            region_id = rng.randint(1, REGIONS)
+            states[region_id] = not states.get(region_id)
+            start = perf_counter()
+            renderer.render(states, incremental)
+            timings.append(perf_counter() - start)
+        report(name, timings, "")
+    drift = np.abs(
+        renderer.draw(states).astype(int) - renderer.draw(states, False).astype(int)
+    ).max()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"max incremental drift {drift}, python peak {peak / 2**20:.1f} MiB")
+
+
+def bench_selenium(runs: int):
+    from map_render import map_render
+
+    timings = []
+    for _ in range(runs):
+        start = perf_counter()
+        image, error, fallback = map_render.get_img()
+        timings.append(perf_counter() - start)
+        if not image or fallback:
+            print(error)
+            return
+    map_render.driver.quit()
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    report("selenium", timings, f"largest browser process {children / 1024:.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--selenium", action="store_true")
+    args = parser.parse_args()
+
+    geometry = getenv("MAP_GEOMETRY")
+    with tempfile.NamedTemporaryFile(suffix=".svg") as f:
+        if not geometry:
+            synthetic_svg(f.name)
+            geometry = f.name
+        bench_native(args.runs, geometry)
+    if args.selenium:
+        bench_selenium(args.runs)
+    print(
+        "max rss of this process "
+        f"{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB"
+    )
+
+
+if __name__ == "__main__":
+    main()
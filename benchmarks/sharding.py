@@ -0,0 +1,131 @@
+"""Check guild partitioning across shard processes against a fake gateway.
+
+Usage: python -m benchmarks.sharding [--shards 4] [--processes 2] [--guilds 5000]
+
+Every process imports the bot with its own SHARD_IDS, gets an in-memory
+ConfigStore holding all guilds, and a fake gateway that resolves every
+channel. The same burst of SSE updates is fed to each process, so a
+guild that is delivered twice or not at all means partitioning is broken.
+"""
+
+import argparse
+import asyncio
+import importlib
+import multiprocessing
+import queue
+import os
+from collections import Counter
+from time import perf_counter
+
+from launcher import split_shards
+
+REGIONS = range(1, 26)
+
+
+def events() -> list[dict]:
+    return [
+        {"id": i, "name": f"Region {i}", "name_en": f"Region {i}", "alert": True}
+        for i in REGIONS
+    ]
+
+
+def run_shard(shard_ids: list[int], shard_count: int, guilds: int, results):
+    os.environ.update(
+        STORAGE_CHANNEL="0",
+        SHARD_COUNT=str(shard_count),
+        SHARD_IDS=",".join(map(str, shard_ids)),
+        REGIONS_CACHE="",
+        # measure partitioning, not Discord's global rate limit
+        DISPATCH_RATE="100000",
+        DISPATCH_CONCURRENCY="64",
+    )
+    module = importlib.import_module("bot.bot")
+
+    from .fakes import FakeGateway, FakeHTTP, MemoryConfigStore, make_configs
+
+    configs = make_configs(guilds)
+    gateway = FakeGateway(configs, FakeHTTP(latency=0.001))
+    module.bot.get_guild = gateway.get_guild
+    module.store = MemoryConfigStore(
+        configs, shard_ids=shard_ids, shard_count=shard_count
+    )
+
+    async def main():
+        module.dispatcher.start()
+        await module.store.start()
+        processor = asyncio.create_task(module.api._process(module.send_alarm))
+        start = perf_counter()
+        for event in events():
+            await module.api._push(event)
+        while module.api._pending or module.dispatcher.depth:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.1)
+        elapsed = perf_counter() - start
+        processor.cancel()
+        await module.dispatcher.close()
+        # let the fan-out tasks observe the shutdown
+        await asyncio.sleep(0.1)
+        return elapsed
+
+    elapsed = module.bot.loop.run_until_complete(main())
+    results.put(
+        (
+            shard_ids,
+            elapsed,
+            [(guild_id, message.content) for guild_id, message in gateway.deliveries],
+        )
+    )
+
+
+def expected(guilds: int) -> Counter:
+    os.environ.setdefault("STORAGE_CHANNEL", "0")
+    from .fakes import make_configs
+
+    counter = Counter()
+    for guild_id, config in make_configs(guilds).items():
+        for region_id in config.regions or REGIONS:
+            counter[(guild_id, f"Region {region_id}")] += 1
+    return counter
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--processes", type=int, default=2)
+    parser.add_argument("--guilds", type=int, default=5000)
+    args = parser.parse_args()
+
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=run_shard, args=(ids, args.shards, args.guilds, results)
+        )
+        for ids in split_shards(args.shards, args.processes)
+    ]
+    for process in processes:
+        process.start()
+    delivered = Counter()
+    for _ in processes:
+        while True:
+            try:
+                shard_ids, elapsed, deliveries = results.get(timeout=1)
+                break
+            except queue.Empty:
+                if any(p.exitcode for p in processes):
+                    raise SystemExit("a shard process failed")
+        print(f"shards {shard_ids}: {len(deliveries)} messages in {elapsed:.2f}s")
+        delivered.update(deliveries)
+    for process in processes:
+        process.join()
+
+    want = expected(args.guilds)
+    duplicated = sum(1 for key, n in delivered.items() if n > 1)
+    missing = sum(1 for key in want if key not in delivered)
+    print(f"expected {sum(want.values())}, delivered {sum(delivered.values())}")
+    print(f"duplicated {duplicated}, missing {missing}")
+    if duplicated or missing:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
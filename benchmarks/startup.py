@@ -0,0 +1,111 @@
+"""Measure cold start: import time, time to listen and time to first alert.
+
+Usage: python -m benchmarks.startup [--runs 5] [--guilds 2000] [--db-delay 1]
+
+Each run starts a fresh interpreter that imports the bot, starts a local
+SSE server and runs bot.listen() with an in-memory store whose startup
+takes --db-delay seconds, standing in for migrations and loading the
+index. The server sends one update as soon as the stream is opened.
+Times are measured from before the interpreter was spawned.
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import subprocess
+import sys
+from statistics import median
+from time import time
+
+STATE = {"id": 1, "name": "Region 1", "name_en": "Region 1", "alert": True}
+
+
+def child(spawned: float, guilds: int, db_delay: float):
+    os.environ.update(STORAGE_CHANNEL="0", API_KEY="startup", REGIONS_CACHE="")
+    module = importlib.import_module("bot.bot")
+    imported = time()
+    api_module = importlib.import_module("bot.api")
+    from aiohttp import web
+
+    from .fakes import FakeGateway, FakeHTTP, MemoryConfigStore, make_configs
+
+    class SlowStore(MemoryConfigStore):
+        async def start(self):
+            await asyncio.sleep(db_delay)
+            await super().start()
+
+    configs = make_configs(guilds)
+    gateway = FakeGateway(configs, FakeHTTP(latency=0.01))
+    module.bot.get_guild = gateway.get_guild
+    module.store = SlowStore(configs)
+    timings = {"import": imported - spawned}
+
+    async def live(request: web.Request) -> web.StreamResponse:
+        timings.setdefault("listening", time() - spawned)
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        data = json.dumps({"state": STATE})
+        await response.write(f"event: update\ndata: {data}\n\n".encode())
+        try:
+            while True:
+                await asyncio.sleep(1)
+                await response.write(b"event: ping\ndata: {}\n\n")
+        except ConnectionResetError:
+            return response
+
+    async def states(request: web.Request) -> web.Response:
+        # the state before the update, as fetched when the stream opens
+        return web.json_response({"states": [dict(STATE, alert=False)]})
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/api/states/live", live)
+        app.router.add_get("/api/states", states)
+        runner = web.AppRunner(app, shutdown_timeout=0)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        api_module.ENDPOINT = f"http://127.0.0.1:{port}/api"
+        listener = asyncio.create_task(module.listen())
+        while not gateway.deliveries:
+            await asyncio.sleep(0.005)
+        timings["first_alert"] = time() - spawned
+        listener.cancel()
+        await module.shutdown()
+        await runner.cleanup()
+
+    module.bot.loop.run_until_complete(main())
+    print(json.dumps(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--guilds", type=int, default=2000)
+    parser.add_argument("--db-delay", type=float, default=1.0)
+    parser.add_argument("--child", type=float, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child is not None:
+        child(args.child, args.guilds, args.db_delay)
+        return
+
+    results = []
+    for _ in range(args.runs):
+        command = [sys.executable, "-m", "benchmarks.startup", "--child", str(time())]
+        command += ["--guilds", str(args.guilds), "--db-delay", str(args.db_delay)]
+        output = subprocess.run(
+            command, capture_output=True, text=True, check=True
+        ).stdout
+        results.append(json.loads(output.splitlines()[-1]))
+    for key in ("import", "listening", "first_alert"):
+        values = [r[key] for r in results]
+        print(
+            f"{key:12} median {median(values) * 1000:7.0f} ms, max {max(values) * 1000:7.0f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,16 @@
+import asyncio
+import json
 import logging
+import os
+import random
 from json import loads
-from typing import Callable, Coroutine
+from time import monotonic, time
+from typing import Callable, Coroutine, Optional
 
-import requests
-from aiohttp_sse_client.client import EventSource
+import aiohttp
+from aiohttp_sse_client.client import READY_STATE_CONNECTING, EventSource
+
+from .metrics import metrics
 
 
 BASE_URL = "https://alerts.com.ua"
@@ -11,28 +18,253 @@ ENDPOINT = BASE_URL + "/api"
 
 
 class API:
-    def __init__(self, key):
+    def __init__(
+        self,
+        key,
+        cache_path: Optional[str] = None,
+        cache_ttl: float = 3600,
+        queue_size: int = 100,
+        idle_timeout: float = 90,
+        backoff_base: float = 1,
+        backoff_max: float = 60,
+    ):
         self.headers = {"X-API-Key": key}
+        self.cache_path = cache_path
+        self.cache_ttl = cache_ttl
+        self.idle_timeout = idle_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # updated in place, so references handed out stay current
+        self.regions: dict[str, int] = {}
+        self.region_names: dict[int, str] = {}
+        self._etag: Optional[str] = None
+        self._fetched = 0.0
+        self._snapshot: list[dict] = []
+        # last processed alert state per region id
+        self.states: dict[int, bool] = {}
+        # called with each reconciled state that isn't pushed as a transition
+        self.on_baseline: Optional[Callable[[dict], None]] = None
+        # called after the region list changed
+        self.on_regions: Optional[Callable[[], None]] = None
+        # regions updated by the stream since the running reconcile began
+        self._streamed: set[int] = set()
+        self._reconciler: Optional[asyncio.Task] = None
+        # latest unprocessed update per region id, queued at most once
+        self._pending: dict[int, dict] = {}
+        self._queue: asyncio.Queue[int] = asyncio.Queue(queue_size)
+        # monotonic time the update being processed was first read per region
+        self.received: dict[int, float] = {}
+        self._received: dict[int, float] = {}
 
     async def listen(self, callback: Callable[[dict], Coroutine]):
-        source = EventSource(
-            ENDPOINT + "/states/live", headers=self.headers, timeout=0
-        )
+        processor = asyncio.create_task(self._process(callback))
+        try:
+            await self._read()
+        finally:
+            processor.cancel()
+            if self._reconciler:
+                self._reconciler.cancel()
+
+    async def _read(self):
+        attempt = 0
+        last_event_id = ""
+        # monotonic time the stream was found dead, until it has recovered
+        lost: Optional[float] = None
+
+        def on_error():
+            # EventSource silently reconnects when the stream ends; surface
+            # it instead so that the gap gets backoff and reconciliation
+            if source.ready_state == READY_STATE_CONNECTING:
+                raise ConnectionError("Stream closed")
+
+        async with aiohttp.ClientSession() as session:
+            while True:
+                headers = dict(self.headers)
+                if last_event_id:
+                    headers["Last-Event-ID"] = last_event_id
+                source = EventSource(
+                    ENDPOINT + "/states/live",
+                    session=session,
+                    headers=headers,
+                    timeout=0,
+                    on_error=on_error,
+                )
+                last_message = monotonic()
+                try:
+                    await source.connect()
+                    # states loaded from the cache or the history log may be
+                    # stale, so the first connect reconciles too; in the
+                    # background, so alerts flow while /api/states is down
+                    if not self._reconciler or (
+                        lost is not None and self._reconciler.done()
+                    ):
+                        self._reconciler = asyncio.create_task(self._reconcile())
+                    if lost is not None:
+                        recovered = monotonic() - lost
+                        metrics.observe("sse_recover", recovered)
+                        logging.warning(f"Stream recovered in {recovered:.1f}s")
+                        lost = None
+                    while True:
+                        message = await asyncio.wait_for(
+                            source.__anext__(), self.idle_timeout
+                        )
+                        last_message = monotonic()
+                        attempt = 0
+                        if message.last_event_id:
+                            last_event_id = message.last_event_id
+                        if message.type != "ping":
+                            logging.info(message)
+                        if message.type == "update":
+                            state = loads(message.data)["state"]
+                            self._streamed.add(state["id"])
+                            await self._push(state)
+                except asyncio.TimeoutError:
+                    logging.error(f"No events for {self.idle_timeout:.0f}s")
+                    metrics.count("sse_disconnects", "idle")
+                except Exception as e:
+                    logging.error(e)
+                    metrics.count("sse_disconnects", type(e).__name__)
+                finally:
+                    await source.close()
+                if lost is None:
+                    lost = monotonic()
+                    metrics.observe("sse_detect", lost - last_message)
+                await self._backoff(attempt)
+                attempt += 1
+
+    async def _backoff(self, attempt: int):
+        delay = min(self.backoff_max, self.backoff_base * 2**attempt)
+        await asyncio.sleep(random.uniform(delay / 2, delay))
+
+    async def _reconcile(self):
+        attempt = 0
         while True:
             try:
-                await source.connect()
-                async for message in source:
-                    if message.type != "ping":
-                        logging.info(message)
-                    if message.type == "update":
-                        await callback(loads(message.data)["state"])
+                missed = await self.reconcile()
+            except Exception as e:
+                logging.error(f"Can't reconcile states: {e}")
+                metrics.count("reconcile_failed", type(e).__name__)
+                await self._backoff(attempt)
+                attempt += 1
+                continue
+            if missed:
+                logging.warning(f"{missed} updates missed while offline")
+            return
+
+    async def reconcile(self) -> int:
+        self._streamed.clear()
+        # a 304 still means the cached snapshot matches upstream
+        await self.refresh_regions(force=True)
+        missed = 0
+        for state in self._snapshot:
+            # the stream is newer than the snapshot
+            if state["id"] in self._streamed:
+                continue
+            known = self.states.get(state["id"])
+            # nothing was sent for a region we knew nothing about, so there
+            # is no transition to catch up on
+            if known is None:
+                self.states[state["id"]] = state["alert"]
+            elif known != state["alert"]:
+                missed += 1
+                await self._push(state)
+                continue
+            if self.on_baseline:
+                self.on_baseline(state)
+        return missed
+
+    async def _push(self, state: dict):
+        region_id = state["id"]
+        metrics.count("events")
+        if region_id in self._pending:
+            self._pending[region_id] = state
+            metrics.count("events_dropped", "coalesced")
+            return
+        if self.states.get(region_id) == state["alert"]:
+            metrics.count("events_dropped", "duplicate")
+            return
+        self._pending[region_id] = state
+        self._received[region_id] = monotonic()
+        await self._queue.put(region_id)
+
+    async def _process(self, callback: Callable[[dict], Coroutine]):
+        while True:
+            region_id = await self._queue.get()
+            state = self._pending.pop(region_id)
+            received = self._received.pop(region_id)
+            # the region may have toggled back while queued
+            if self.states.get(region_id) == state["alert"]:
+                metrics.count("events_dropped", "toggled_back")
+                continue
+            self.states[region_id] = state["alert"]
+            self.received[region_id] = received
+            metrics.observe("receive", monotonic() - received)
+            try:
+                await callback(state)
             except Exception as e:
                 logging.error(e)
 
-    def get_regions(self) -> dict[str, int]:
-        return {
-            s["name"]: s["id"]
-            for s in requests.get(ENDPOINT + "/states", headers=self.headers).json()[
-                "states"
-            ]
-        }
+    def load_cache(self) -> bool:
+        if not self.cache_path:
+            return False
+        try:
+            with open(self.cache_path, encoding="utf-8") as f:
+                cache = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Can't read regions cache: {e}")
+            return False
+        self._etag = cache.get("etag")
+        self._fetched = cache.get("fetched", 0.0)
+        self._snapshot = cache["states"]
+        self._set_regions(self._snapshot)
+        # only a baseline: _read reconciles it with upstream on first connect
+        for state in cache["states"]:
+            self.states.setdefault(state["id"], state["alert"])
+        return True
+
+    def _save_cache(self):
+        if not self.cache_path:
+            return
+        tmp = self.cache_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "etag": self._etag,
+                    "fetched": self._fetched,
+                    "states": self._snapshot,
+                },
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(tmp, self.cache_path)
+
+    def _set_regions(self, states: list[dict]) -> bool:
+        regions = {s["name"]: s["id"] for s in states}
+        if regions == self.regions:
+            return False
+        self.regions.clear()
+        self.regions.update(regions)
+        self.region_names.clear()
+        self.region_names.update((v, k) for k, v in regions.items())
+        if self.on_regions:
+            self.on_regions()
+        return True
+
+    async def refresh_regions(self, force: bool = False) -> bool:
+        if not force and time() - self._fetched < self.cache_ttl:
+            return False
+        headers = dict(self.headers)
+        if self._etag and self._snapshot:
+            headers["If-None-Match"] = self._etag
+        async with aiohttp.ClientSession() as session:
+            async with session.get(ENDPOINT + "/states", headers=headers) as resp:
+                if resp.status != 304:
+                    resp.raise_for_status()
+                    self._snapshot = (await resp.json())["states"]
+                    self._etag = resp.headers.get("ETag")
+        self._fetched = time()
+        try:
+            self._save_cache()
+        except OSError as e:
+            logging.warning(f"Can't write regions cache: {e}")
+        return self._set_regions(self._snapshot)
@@ -1,12 +1,14 @@
 import json
 import logging
-import re
 import asyncio
-from time import time, monotonic as monotonic_time
+from time import time, monotonic as monotonic_time, perf_counter
+from datetime import datetime
 from os import getenv
 from io import BytesIO, StringIO
-from typing import Optional, Awaitable
 from base64 import b64encode
+from functools import partial
+from itertools import count
+from typing import Optional
 from urllib.request import quote as encode_for_url
 
 import discord
@@ -15,27 +17,89 @@ from dotenv import load_dotenv
 
 from . import db
 from .api import API
-from map_render import render as render_map
+from .digest import DigestBuffer
+from .dispatch import Dispatcher
+from .eligibility import Eligibility, EligibilityCache
+from .history import AlertHistory
+from .map_updates import MapRefresher, MessageTracker
+from .metrics import metrics
+from .templates import PLACEHOLDER, compile_template
+from .webhooks import WebhookSender
+from map_render import (
+    cache as map_cache,
+    pool as render_pool,
+    optimizer as map_optimizer,
+)
 
 
 load_dotenv()
 logging.basicConfig(level=logging.WARN, handlers=[logging.StreamHandler()])
 
-PLACEHOLDER = re.compile(r"%(\w+)%")
-MANDATORY = ("name", "name_en")
+MANDATORY = ("name", "name_en", "names", "names_en")
+
+
+SHARD_COUNT = int(getenv("SHARD_COUNT", 0)) or None
+SHARD_IDS = (
+    [int(i) for i in getenv("SHARD_IDS").split(",")] if getenv("SHARD_IDS") else None
+)
+
+
+class AlarmBot(discord.AutoShardedBot if SHARD_COUNT else discord.Bot):
+    async def close(self):
+        await shutdown()
+        await super().close()
 
 
 DEBUG_GUILD = getenv("DEBUG_GUILD")
-bot = discord.Bot(debug_guilds=[int(DEBUG_GUILD)] if DEBUG_GUILD else None)
-api = API(getenv("API_KEY"))
-store = db.ConfigStore(getenv("DATABASE_URL"))
-
-try:
-    REGION_IDS = api.get_regions()
-except Exception as e:
-    REGION_IDS = {}
-    logging.error(e)
-REGION_NAMES = {v: k for k, v in REGION_IDS.items()}
+bot = AlarmBot(
+    debug_guilds=[int(DEBUG_GUILD)] if DEBUG_GUILD else None,
+    **({"shard_count": SHARD_COUNT, "shard_ids": SHARD_IDS} if SHARD_COUNT else {}),
+)
+api = API(
+    getenv("API_KEY"),
+    cache_path=getenv("REGIONS_CACHE", "regions.json"),
+    cache_ttl=float(getenv("REGIONS_CACHE_TTL", 3600)),
+    idle_timeout=float(getenv("SSE_IDLE_TIMEOUT", 90)),
+    backoff_max=float(getenv("SSE_BACKOFF_MAX", 60)),
+)
+store = db.ConfigStore(
+    getenv("DATABASE_URL"),
+    use_index=bool(getenv("CONFIG_INDEX")),
+    shard_ids=SHARD_IDS,
+    shard_count=SHARD_COUNT or 1,
+    max_size=int(getenv("DATABASE_POOL_SIZE", 10)),
+)
+dispatcher = Dispatcher(
+    concurrency=int(getenv("DISPATCH_CONCURRENCY", 8)),
+    rate=float(getenv("DISPATCH_RATE", 45)),
+)
+# webhook sends are limited per webhook and per IP, not by the bot's global
+# limit, so they get their own queue
+webhook_dispatcher = Dispatcher(
+    concurrency=int(getenv("WEBHOOK_DISPATCH_CONCURRENCY", 16)),
+    rate=float(getenv("WEBHOOK_DISPATCH_RATE", 45)),
+)
+webhooks = WebhookSender(connections=int(getenv("WEBHOOK_CONNECTIONS", 100)))
+eligibility = EligibilityCache(bot)
+# seconds a subscription may stay undeliverable before it is deleted
+PRUNE_AFTER = float(getenv("PRUNE_AFTER", 0))
+PRUNE_INTERVAL = float(getenv("PRUNE_INTERVAL", 3600))
+STORE_RETRY_MAX = float(getenv("DATABASE_RETRY_MAX", 60))
+
+history = AlertHistory(
+    getenv("ALERT_HISTORY"),
+    retention=float(getenv("ALERT_HISTORY_RETENTION", 30 * 86400)),
+)
+HISTORY_COMPACT_INTERVAL = float(getenv("ALERT_HISTORY_COMPACT_INTERVAL", 86400))
+HISTORY_LIMIT = int(getenv("ALERT_HISTORY_LIMIT", 20))
+
+api.load_cache()
+# the history log is written on every transition, so it is newer than the
+# regions cache
+if history.load():
+    api.states.update((i, alert) for i, (alert, _) in history.states.items())
+REGION_IDS = api.regions
+REGION_NAMES = api.region_names
 REGION_OPTIONS = tuple(
     discord.OptionChoice(name, id_) for name, id_ in REGION_IDS.items()
 )
@@ -56,14 +120,63 @@ EXAMPLE_EMBED = b64encode(
 DEFAULT_IMAGE_URL = "https://media.discordapp.net/attachments/986235489508028506/986235602661965884/loading.png"
 STORAGE_CHANNEL = int(getenv("STORAGE_CHANNEL"))
 
-last_map_time = 0
+METRICS_PORT = int(getenv("METRICS_PORT", 0))
+METRICS_LOG_INTERVAL = float(getenv("METRICS_LOG_INTERVAL", 0))
+metrics.enabled = bool(METRICS_PORT or METRICS_LOG_INTERVAL)
+metrics.gauge("dispatch_queue_depth", lambda: dispatcher.depth)
+metrics.gauge("webhook_queue_depth", lambda: webhook_dispatcher.depth)
+
+listener: Optional[asyncio.Task] = None
+_background: set[asyncio.Task] = set()
 
 
 @bot.event
 async def on_ready():
+    eligibility.clear()
     print("Ready")
 
 
+@bot.listen()
+async def on_guild_channel_update(before, after):
+    eligibility.invalidate_channel(after.id)
+
+
+@bot.listen()
+async def on_guild_channel_delete(channel):
+    eligibility.invalidate_channel(channel.id)
+
+
+@bot.listen("on_guild_role_create")
+@bot.listen("on_guild_role_delete")
+async def on_guild_role_change(role: discord.Role):
+    eligibility.invalidate_guild(role.guild.id)
+
+
+@bot.listen()
+async def on_guild_role_update(before: discord.Role, after: discord.Role):
+    eligibility.invalidate_guild(after.guild.id)
+
+
+@bot.listen()
+async def on_member_update(before: discord.Member, after: discord.Member):
+    # roles or timeout of the bot itself
+    if after.id == bot.user.id:
+        eligibility.invalidate_guild(after.guild.id)
+
+
+@bot.listen("on_guild_join")
+@bot.listen("on_guild_remove")
+@bot.listen("on_guild_available")
+@bot.listen("on_guild_unavailable")
+async def on_guild_change(guild: discord.Guild):
+    eligibility.invalidate_guild(guild.id)
+
+
+@bot.listen()
+async def on_guild_update(before: discord.Guild, after: discord.Guild):
+    eligibility.invalidate_guild(after.id)
+
+
 @bot.event
 async def on_application_command_error(ctx, exception):
     if isinstance(exception, commands.MissingPermissions):
@@ -98,6 +211,11 @@ async def help(ctx: discord.ApplicationContext):
 Використовуйте `%name%`, щоб підставити назву області в текст, або
 `%name_en%` для назви англійською.
 Замість `%map%` буде підставлено посилання на поточну карту.
+Увімкніть опцію `дайджест`, щоб тривоги, оголошені майже одночасно,
+приходили одним повідомленням. `%names%` і `%names_en%` (а в дайджесті
+також `%name%` і `%name_en%`) містять перелік усіх областей.
+Увімкніть опцію `вебхук`, щоб сповіщення надходили через вебхук каналу
+(потрібне право керувати вебхуками).
 """,
         inline=False,
     )
@@ -113,7 +231,8 @@ async def help(ctx: discord.ApplicationContext):
         name="4.",
         value="""Готово! Всі сповіщення будуть приходити в канал, що ви вказали.
 Налаштування можна перевірити за допомогою команди `/show_config`
-Якщо хочете відключити бота, використайте `/delete_config`""",
+Якщо хочете відключити бота, використайте `/delete_config`
+`/status` покаже, де зараз триває тривога, а `/history` — історію тривог в області.""",
         inline=False,
     )
     embed.add_field(
@@ -136,6 +255,15 @@ async def configure(
     text_end: discord.Option(
         str, "текст сповіщення про відбій тривоги", name="відбій_тривоги"
     ),
+    webhook: discord.Option(
+        bool, "надсилати сповіщення через вебхук", name="вебхук", default=False
+    ),
+    digest: discord.Option(
+        bool,
+        "об'єднувати одночасні тривоги в одне повідомлення",
+        name="дайджест",
+        default=False,
+    ),
 ):
     await ctx.respond("Налаштування...")
     if not channel.permissions_for(ctx.guild.me).embed_links:
@@ -149,7 +277,30 @@ async def configure(
     except discord.HTTPException:
         await ctx.respond("Неправильно сформований ембед.")
         return
-    await store.set(ctx.guild.id, channel.id, text_begin, text_end)
+    old = await store.get(ctx.guild.id)
+    webhook_id = webhook_token = None
+    if webhook:
+        try:
+            hook = await channel.create_webhook(name=bot.user.name)
+        except discord.Forbidden:
+            await ctx.respond(
+                "У бота немає прав керувати вебхуками у вказаному каналі!"
+            )
+            return
+        webhook_id, webhook_token = hook.id, hook.token
+    await store.set(
+        ctx.guild.id,
+        channel.id,
+        text_begin,
+        text_end,
+        webhook_id,
+        webhook_token,
+        digest,
+    )
+    if old and old.webhook_id:
+        await delete_webhook(old.webhook_id, old.webhook_token)
+    compile_template(text_begin)
+    compile_template(text_end)
     await ctx.respond("Налаштування завершено!")
 
 
@@ -198,11 +349,14 @@ async def show_config(ctx: discord.ApplicationContext):
     if not config:
         await ctx.respond("Бота не налаштовано!")
         return
-    view = ShowConfig(config[1], config[2])
+    view = ShowConfig(config.text_begin, config.text_end)
+    regions = config.regions
     view.message = await ctx.respond(
-        f"""Канал: <#{config[0]}>
+        f"""Канал: <#{config.channel_id}>{" (через вебхук)" if config.webhook_id else ""}
+Дайджест: {"так" if config.digest else "ні"}
 Обрані регіони: {
-    ", ".join(REGION_NAMES[i] for i in config[3]) if config[3] else "вся Україна"
+    ", ".join(REGION_NAMES.get(i, str(i)) for i in regions)
+    if regions else "вся Україна"
 }.""",
         allowed_mentions=discord.AllowedMentions.none(),
         view=view,
@@ -229,8 +383,8 @@ class ShowMessage(discord.ui.Button):
         self.msg = msg
 
     async def callback(self, interaction: discord.Interaction):
-        text, embed = load_template(
-            format_message(self.msg, {"map": DEFAULT_IMAGE_URL}, True)
+        text, embed = compile_template(self.msg).render(
+            {"map": DEFAULT_IMAGE_URL}, True
         )
         await interaction.response.send_message(text, embed=embed, ephemeral=True)
 
@@ -240,119 +394,421 @@ class ShowMessage(discord.ui.Button):
 @commands.has_permissions(manage_guild=True)
 async def delete_config(ctx: discord.ApplicationContext):
     await ctx.defer()
+    old = await store.get(ctx.guild.id)
     await store.delete(ctx.guild.id)
+    if old and old.webhook_id:
+        await delete_webhook(old.webhook_id, old.webhook_token)
     await ctx.respond("Налаштування видалено.")
 
 
+@bot.slash_command(description="показати області, де зараз триває тривога")
+async def status(ctx: discord.ApplicationContext):
+    active = history.active()
+    if not active:
+        await ctx.respond("Тривог немає.")
+        return
+    await ctx.respond(
+        "\n".join(
+            f"🔴 {REGION_NAMES.get(i, str(i))} з <t:{since:.0f}:t> (<t:{since:.0f}:R>)"
+            for i, since in active
+        )
+    )
+
+
+@bot.slash_command(name="history", description="показати історію тривог в області")
+async def alert_history(
+    ctx: discord.ApplicationContext,
+    region: discord.Option(int, name="регіон", choices=REGION_OPTIONS),
+    days: discord.Option(
+        int, "за скільки днів", name="днів", min_value=1, max_value=30, default=7
+    ),
+):
+    changes = history.history(region, time() - days * 86400, limit=HISTORY_LIMIT)
+    name = REGION_NAMES.get(region, str(region))
+    if not changes:
+        await ctx.respond(f"{name}: тривог не було.")
+        return
+    lines = [
+        f"{'🔴 тривога' if alert else '🟢 відбій'} <t:{changed:.0f}:f>"
+        for alert, changed in reversed(changes)
+    ]
+    await ctx.respond(f"{name}:\n" + "\n".join(lines))
+
+
 @bot.slash_command(description="показати поточну карту")
 async def map(ctx: discord.ApplicationContext):
     await ctx.defer()
     start = time()
-    data, error = await render_map()
+    url = await get_map_url()
     logging.info(f"Rendering took {time()-start:.2f}")
-    if not data:
-        await send_error(error)
+    if not url:
         raise RuntimeError()
-    await ctx.respond(file=discord.File(BytesIO(data), filename="map.png"))
-
-
-def format_message(text: str, data: dict, strict=False):
-    return PLACEHOLDER.sub(
-        lambda m: data.get(m.group(1), m.group() if strict else None), text
-    )
-
-
-def load_template(template: str) -> tuple[str, Optional[discord.Embed]]:
-    try:
-        data = json.loads(template)
-    except json.JSONDecodeError:
-        data = None
-    if isinstance(data, dict):
-        embed = data.get("embed") or (data["embeds"][0] if data.get("embeds") else None)
-        return (
-            data.get("content", ""),
-            discord.Embed.from_dict(embed) if embed else None,
-        )
-    return template, None
+    await ctx.respond(url)
 
 
 async def show_and_reserialize(ctx, template: str):
-    text, embed = load_template(
-        format_message(template, {"map": DEFAULT_IMAGE_URL}, True)
-    )
+    compiled = compile_template(template)
+    text, embed = compiled.render({"map": DEFAULT_IMAGE_URL}, True)
     if not any(x in MANDATORY for x in PLACEHOLDER.findall(template)):
         add = "%name%\n"
     else:
         add = ""
     await ctx.respond(add + text, embed=embed, ephemeral=True)
-    text, embed = load_template(template)
+    text, embed = compiled.render({}, True)
     return json.dumps(
         {"content": add + text, "embed": embed.to_dict() if embed else {}}
     )
 
 
+# the storage channel may live in a guild another shard process owns, so
+# it can't be looked up in this process's cache
 async def send_error(e: str):
-    await bot.get_channel(STORAGE_CHANNEL).send(
+    await bot.get_partial_messageable(STORAGE_CHANNEL).send(
         file=discord.File(StringIO(e), filename="error.txt")
     )
 
 
+async def upload_map(image: bytes) -> str:
+    file = discord.File(BytesIO(image), filename=f"map.{map_optimizer.extension}")
+    with metrics.timer("upload"):
+        message = await bot.get_partial_messageable(STORAGE_CHANNEL).send(file=file)
+    return message.attachments[0].url
+
+
+async def get_map_url(min_time: Optional[float] = None) -> Optional[str]:
+    with metrics.timer("map_render"):
+        result = await map_cache.get(min_time)
+    result, url = await map_cache.get_url(upload_map, result=result)
+    if result.fallback:
+        logging.warning(f"Serving fallback map, rendering failed:\n{result.error}")
+    elif not result.image:
+        await send_error(result.error)
+    return url
+
+
+async def delete_webhook(webhook_id: int, token: str):
+    try:
+        await webhooks.webhook(webhook_id, token).delete()
+    except discord.HTTPException as e:
+        logging.warning(f"Can't delete webhook {webhook_id}: {e}")
+
+
+async def send_webhook(
+    config: db.GuildConfig,
+    channel: discord.abc.Messageable,
+    msg: Optional[str],
+    embed: Optional[discord.Embed],
+) -> discord.Message:
+    try:
+        return await webhooks.send(config.webhook_id, config.webhook_token, msg, embed)
+    except discord.NotFound:
+        # deleted from the channel settings, go back to sending as the bot
+        logging.warning(f"Webhook {config.webhook_id} is gone, sending as the bot")
+        metrics.count("webhook_gone")
+        in_background(
+            store.clear_webhook(config.guild_id, config.webhook_id), "Webhook cleanup"
+        )
+        return await channel.send(msg, embed=embed)
+
+
+def get_partial_message(
+    channel_id: int, message_id: int, webhook: Optional[tuple[int, str]] = None
+) -> discord.PartialMessage:
+    if webhook:
+        return webhooks.get_partial_message(*webhook, message_id)
+    return bot.get_partial_messageable(channel_id).get_partial_message(message_id)
+
+
+map_refresher = MapRefresher(
+    get_map_url,
+    get_partial_message,
+    dispatcher,
+    MessageTracker(
+        size=int(getenv("MAP_TRACKER_SIZE", 10000)),
+        max_age=float(getenv("MAP_TRACKER_MAX_AGE", 3600)),
+        snapshot_path=getenv("MAP_TRACKER_SNAPSHOT"),
+    ),
+    debounce=float(getenv("MAP_DEBOUNCE", 5)),
+    max_staleness=float(getenv("MAP_MAX_STALENESS", 30)),
+    follow_up=float(getenv("MAP_FOLLOW_UP", 30)),
+    save_interval=float(getenv("MAP_TRACKER_SAVE_INTERVAL", 10)),
+)
+metrics.gauge("map_refresh_pending", lambda: map_refresher.pending)
+
+
+def get_target(config: db.GuildConfig) -> Optional[Eligibility]:
+    target = eligibility.get(config.guild_id, config.channel_id)
+    # webhooks don't need the bot's own permissions in the channel
+    if target.reason and not (config.webhook_id and target.channel):
+        metrics.count("skipped", target.reason)
+        return None
+    return target
+
+
+def submit_message(
+    config: db.GuildConfig,
+    target: Eligibility,
+    msg: str,
+    embed: Optional[discord.Embed],
+    key: tuple,
+    received: float,
+) -> Optional[asyncio.Future]:
+    if config.webhook_id:
+        return webhook_dispatcher.submit(
+            key,
+            received,
+            partial(send_webhook, config, target.channel, msg, embed),
+            "webhook_send",
+        )
+    if not msg and embed and not target.embed_links:
+        metrics.count("skipped", "no_embed_permissions")
+        return None
+    return dispatcher.submit(
+        key, received, partial(target.channel.send, msg, embed=embed)
+    )
+
+
+async def send_digest(config: db.GuildConfig, data: dict, received: float):
+    target = get_target(config)
+    if not target:
+        return
+    text = config.text_begin if data["alert"] else config.text_end
+    msg, embed = compile_template(text).render(data)
+    future = submit_message(
+        config,
+        target,
+        msg,
+        embed,
+        # every digest carries different regions, so none may supersede another
+        (config.channel_id, "digest", next(digest_ids)),
+        received,
+    )
+    if not future:
+        return
+    try:
+        message = await future
+    except Exception as e:
+        logging.error(e)
+        metrics.count("send_failed", type(e).__name__)
+        return
+    if message and "%map%" in text:
+        track_map_link(message, text, data, config)
+
+
+digest_ids = count()
+digests = DigestBuffer(send_digest, window=float(getenv("DIGEST_WINDOW", 3)))
+metrics.gauge("digest_pending", lambda: digests.pending)
+
+
+def changed_at(data: dict) -> Optional[float]:
+    try:
+        return datetime.fromisoformat(data["changed"]).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def seed_baseline(state: dict):
+    # /status and the native map need regions that were already in alert
+    # before startup
+    render_pool.update({state["id"]: state["alert"]})
+    if state["id"] not in history.states:
+        history.append(state["id"], state["alert"], changed_at(state))
+
+
+api.on_baseline = seed_baseline
+
+
 async def send_alarm(data: dict):
-    pending_messages: list[tuple[Awaitable[discord.Message], str]] = []
-    pending_updates: list[tuple[discord.Message, str]] = []
+    received = api.received.get(data["id"]) or monotonic_time()
+    history.append(data["id"], data["alert"], changed_at(data))
+    map_cache.invalidate()
+    render_pool.update({data["id"]: data["alert"]})
+    pending_messages: list[tuple[asyncio.Future, str, db.GuildConfig]] = []
     data["map"] = DEFAULT_IMAGE_URL
-    for channel_id, text_begin, text_end in await store.get_for(data["id"]):
-        channel = bot.get_channel(channel_id)
-        if (
-            not channel
-            or channel.guild.me.timed_out
-            or not (perms := channel.permissions_for(channel.guild.me)).send_messages
-        ):
+    data["names"], data["names_en"] = data["name"], data["name_en"]
+    with metrics.timer("db_lookup"):
+        configs = await store.get_for(data["id"])
+    render_time = 0.0
+    for config in configs:
+        if config.digest:
+            digests.add(config, data, received)
             continue
-        text = text_begin if data["alert"] else text_end
-        msg, embed = load_template(format_message(text, data))
-        if not msg and embed and not perms.embed_links:
+        target = get_target(config)
+        if not target:
             continue
-        coro = channel.send(msg, embed=embed)
-        pending_messages.append((coro, text))
+        text = config.text_begin if data["alert"] else config.text_end
+        start = perf_counter()
+        msg, embed = compile_template(text).render(data)
+        render_time += perf_counter() - start
+        future = submit_message(
+            config, target, msg, embed, (config.channel_id, data["id"]), received
+        )
+        if future:
+            pending_messages.append((future, text, config))
+    metrics.observe("template_render", render_time)
+
+    in_background(deliver(data, pending_messages, received), "Delivery")
+
 
+async def deliver(
+    data: dict,
+    pending_messages: list[tuple[asyncio.Future, str, db.GuildConfig]],
+    received: float,
+):
+    pending_updates: list[tuple[discord.Message, str, db.GuildConfig]] = []
     for i, message in enumerate(
-        await asyncio.gather(*(coro for coro, _ in pending_messages))
+        await asyncio.gather(
+            *(future for future, _, _ in pending_messages), return_exceptions=True
+        )
     ):
-        text = pending_messages[i][1]
-        if "%map%" in text:
-            pending_updates.append((message, text))
+        if isinstance(message, BaseException):
+            logging.error(message)
+            metrics.count("send_failed", type(message).__name__)
+            continue
+        _, text, config = pending_messages[i]
+        # None means a newer state for the same channel superseded this one
+        if message and "%map%" in text:
+            pending_updates.append((message, text, config))
+    metrics.observe("fanout", monotonic_time() - received)
+    logging.info(f"Dispatcher: {dispatcher.stats()}")
+    logging.info(f"Webhook dispatcher: {webhook_dispatcher.stats()}")
+    for message, text, config in pending_updates:
+        track_map_link(message, text, data, config)
+
+
+def track_map_link(
+    message: discord.Message, text: str, data: dict, config: db.GuildConfig
+):
+    # webhook messages can only be edited through the webhook that sent
+    # them, and only if it was still there
+    webhook = None
+    if isinstance(message, discord.WebhookMessage):
+        webhook = (config.webhook_id, config.webhook_token)
+    map_refresher.add(config.channel_id, message.id, text, data, webhook=webhook)
 
-    async def update_pending(repeat: bool):
-        global last_map_time
 
-        last_map_time = monotonic_time()
-        image, error = await render_map()
-        if not image:
-            await send_error(error)
-            return
-        file = discord.File(BytesIO(image), filename="map.png")
-        data["map"] = (
-            (await bot.get_channel(STORAGE_CHANNEL).send(file=file)).attachments[0].url
-        )
+async def refresh_regions():
+    try:
+        await api.refresh_regions()
+    except Exception as e:
+        logging.error(f"Can't refresh regions: {e}")
 
-        tasks = []
-        for message, text in pending_updates:
-            msg, embed = load_template(format_message(text, data))
-            tasks.append(message.edit(content=msg, embed=embed))
-        await asyncio.gather(*tasks)
 
-        if not repeat:
-            return
-        await asyncio.sleep(30)
-        if monotonic_time() - last_map_time >= 30:
-            await update_pending(False)
+def update_region_choices():
+    choices = [discord.OptionChoice(name, id_) for name, id_ in REGION_IDS.items()]
+    for command in (add_region, remove_region, alert_history):
+        command.options[0].choices = choices
+    # commands are synced on connect anyway
+    if bot.is_ready():
+        in_background(bot.sync_commands(), "Command sync")
+
+
+api.on_regions = update_region_choices
+
+
+async def prune_subscriptions():
+    while True:
+        await asyncio.sleep(PRUNE_INTERVAL)
+        if not bot.is_ready():
+            continue
+        ineligible, eligible = [], []
+        for guild_id, channel_id, webhook_id in await store.channels():
+            guild = bot.get_guild(guild_id)
+            if guild and guild.unavailable:
+                continue
+            reason = eligibility.get(guild_id, channel_id).reason
+            # a timeout always ends by itself
+            if reason == "timed_out":
+                continue
+            if webhook_id and reason != "missing_channel":
+                reason = None
+            (ineligible if reason else eligible).append(guild_id)
+        try:
+            pruned = await store.prune(ineligible, eligible, PRUNE_AFTER)
+        except Exception as e:
+            logging.error(f"Can't prune subscriptions: {e}")
+            continue
+        metrics.count("pruned", value=len(pruned))
+        if pruned:
+            logging.warning(f"Pruned {len(pruned)} undeliverable subscriptions")
 
-    bot.loop.create_task(update_pending(True))
+
+def _log_failure(task: asyncio.Task):
+    _background.discard(task)
+    if not task.cancelled() and task.exception():
+        logging.error(f"{task.get_name()} failed: {task.exception()!r}")
+
+
+def in_background(coro, name: str) -> asyncio.Task:
+    task = bot.loop.create_task(coro, name=name)
+    _background.add(task)
+    task.add_done_callback(_log_failure)
+    return task
+
+
+async def start_store():
+    # everything that touches the store waits until this succeeds
+    attempt = 0
+    while True:
+        try:
+            await store.start()
+            return
+        except Exception as e:
+            delay = min(STORE_RETRY_MAX, 2**attempt)
+            attempt += 1
+            logging.error(f"Can't start config store, retrying in {delay:.0f}s: {e}")
+            metrics.count("store_start_failed")
+            await asyncio.sleep(delay)
+
+
+async def compact_history():
+    while True:
+        try:
+            history.compact()
+        except OSError as e:
+            logging.error(f"Can't compact alert history: {e}")
+        await asyncio.sleep(HISTORY_COMPACT_INTERVAL)
+
+
+async def listen():
+    dispatcher.start()
+    webhook_dispatcher.start()
+    map_refresher.start()
+    render_pool.update(api.states)
+    render_pool.start()
+    # the stream is read first so that updates arriving during startup are
+    # queued; send_alarm waits for the store before looking up subscribers
+    in_background(start_store(), "Config store startup")
+    in_background(refresh_regions(), "Region refresh")
+    in_background(metrics.start(METRICS_PORT, METRICS_LOG_INTERVAL), "Metrics")
+    in_background(compact_history(), "History compaction")
+    if PRUNE_AFTER:
+        in_background(prune_subscriptions(), "Subscription pruning")
+    await api.listen(send_alarm)
+
+
+async def shutdown():
+    global listener
+    if listener:
+        listener.cancel()
+        listener = None
+    for task in _background:
+        task.cancel()
+    await asyncio.gather(*_background, return_exceptions=True)
+    await digests.close()
+    await map_refresher.close()
+    await metrics.close()
+    await dispatcher.close()
+    await webhook_dispatcher.close()
+    await webhooks.close()
+    await render_pool.close()
+    await store.close()
+    history.close()
 
 
 def run():
-    bot.loop.create_task(api.listen(send_alarm))
+    global listener
+    listener = bot.loop.create_task(listen())
     bot.run(getenv("TOKEN"))
 
 
@@ -1,120 +1,635 @@
-from typing import Optional, TypeVar
+import asyncio
+import logging
+import os
+from sys import intern
+from typing import Any, AsyncIterable, Awaitable, Callable, Iterable, Optional, Union
 
 import asyncpg
 
-Row = TypeVar("Row", bound=tuple[int, str, str])
-RowWithRegions = TypeVar(
-    "RowWithRegions", bound=tuple[int, str, str, Optional[list[int]]]
+MIGRATIONS = (
+    """
+    CREATE TABLE IF NOT EXISTS
+    configs (
+        guild_id VARCHAR(25) PRIMARY KEY,
+        channel_id VARCHAR(25),
+        text_begin TEXT,
+        text_end TEXT,
+        regions INT ARRAY
+    )
+    """,
+    """
+    ALTER TABLE configs
+        ALTER COLUMN guild_id TYPE BIGINT USING guild_id::BIGINT,
+        ALTER COLUMN channel_id TYPE BIGINT USING channel_id::BIGINT;
+    UPDATE configs SET regions = '{}' WHERE regions IS NULL;
+    ALTER TABLE configs
+        ALTER COLUMN regions SET DEFAULT '{}',
+        ALTER COLUMN regions SET NOT NULL;
+    CREATE INDEX configs_regions_idx ON configs USING GIN (regions);
+    CREATE INDEX configs_all_regions_idx ON configs (guild_id) WHERE regions = '{}';
+    """,
+    """
+    ALTER TABLE configs ADD COLUMN ineligible_since TIMESTAMPTZ;
+    CREATE INDEX configs_ineligible_idx ON configs (ineligible_since)
+        WHERE ineligible_since IS NOT NULL;
+    """,
+    """
+    ALTER TABLE configs
+        ADD COLUMN webhook_id BIGINT,
+        ADD COLUMN webhook_token TEXT;
+    """,
+    "ALTER TABLE configs ADD COLUMN digest BOOLEAN NOT NULL DEFAULT FALSE",
 )
 
+QUERIES = {
+    "set": """
+        INSERT INTO configs (
+            guild_id, channel_id, text_begin, text_end, webhook_id, webhook_token,
+            digest
+        )
+        VALUES ($1, $2, $3, $4, $5, $6, $7)
+        ON CONFLICT (guild_id) DO UPDATE
+        SET channel_id = $2, text_begin = $3, text_end = $4,
+            webhook_id = $5, webhook_token = $6, digest = $7, ineligible_since = NULL
+        RETURNING regions
+        """,
+    "get": """
+        SELECT channel_id, text_begin, text_end, regions, webhook_id, webhook_token,
+            digest
+        FROM configs WHERE guild_id = $1
+        """,
+    "get_all": """
+        SELECT guild_id, channel_id, text_begin, text_end, regions,
+            webhook_id, webhook_token, digest
+        FROM configs
+        """,
+    "delete": "DELETE FROM configs WHERE guild_id = $1",
+    "get_for": """
+        SELECT guild_id, channel_id, text_begin, text_end, webhook_id, webhook_token,
+            digest
+        FROM configs
+        WHERE regions = '{}' AND (guild_id >> 22) % $2 = ANY($3::INT[])
+        UNION ALL
+        SELECT guild_id, channel_id, text_begin, text_end, webhook_id, webhook_token,
+            digest
+        FROM configs
+        WHERE regions @> ARRAY[$1::INT] AND (guild_id >> 22) % $2 = ANY($3::INT[])
+        """,
+    "add_region": """
+        UPDATE configs
+        SET regions = array_append(regions, $2)
+        WHERE guild_id = $1 AND array_position(regions, $2) IS NULL
+        RETURNING regions
+        """,
+    "remove_region": """
+        UPDATE configs
+        SET regions = array_remove(regions, $2)
+        WHERE guild_id = $1 AND array_position(regions, $2) IS NOT NULL
+        RETURNING regions
+        """,
+    "remove_all_regions": "UPDATE configs SET regions = $2 WHERE guild_id = $1",
+    "clear_webhook": """
+        UPDATE configs SET webhook_id = NULL, webhook_token = NULL
+        WHERE guild_id = $1 AND webhook_id = $2
+        RETURNING regions
+        """,
+    "get_channels": """
+        SELECT guild_id, channel_id, webhook_id FROM configs
+        WHERE (guild_id >> 22) % $1 = ANY($2::INT[])
+        """,
+    "mark_ineligible": """
+        UPDATE configs SET ineligible_since = now()
+        WHERE guild_id = ANY($1::BIGINT[]) AND ineligible_since IS NULL
+        """,
+    "mark_eligible": """
+        UPDATE configs SET ineligible_since = NULL
+        WHERE guild_id = ANY($1::BIGINT[]) AND ineligible_since IS NOT NULL
+        """,
+    "prune": """
+        DELETE FROM configs
+        WHERE ineligible_since < now() - make_interval(secs => $1)
+            AND (guild_id >> 22) % $2 = ANY($3::INT[])
+        RETURNING guild_id
+        """,
+    "add_region_many": """
+        UPDATE configs SET regions = array_append(regions, $2)
+        WHERE guild_id = ANY($1::BIGINT[]) AND NOT regions @> ARRAY[$2::INT]
+        RETURNING guild_id, regions
+        """,
+    "remove_region_many": """
+        UPDATE configs SET regions = array_remove(regions, $2)
+        WHERE guild_id = ANY($1::BIGINT[]) AND regions @> ARRAY[$2::INT]
+        RETURNING guild_id, regions
+        """,
+    "delete_many": """
+        DELETE FROM configs WHERE guild_id = ANY($1::BIGINT[]) RETURNING guild_id
+        """,
+    "notify": "SELECT pg_notify('configs_changed', $1)",
+}
+
+# NOTIFY channel for writes that processes holding an index should reload after
+CHANGED = "configs_changed"
+
+# columns moved by export_configs, import_configs and set_many
+BULK_COLUMNS = (
+    "guild_id",
+    "channel_id",
+    "text_begin",
+    "text_end",
+    "regions",
+    "webhook_id",
+    "webhook_token",
+    "digest",
+)
+BULK_STAGE = """
+    CREATE TEMP TABLE configs_import (LIKE configs INCLUDING DEFAULTS) ON COMMIT DROP
+    """
+BULK_REPLACE = """
+    DELETE FROM configs WHERE guild_id NOT IN (SELECT guild_id FROM configs_import)
+    """
+BULK_UPSERT = f"""
+    INSERT INTO configs ({", ".join(BULK_COLUMNS)})
+    SELECT {", ".join(BULK_COLUMNS)} FROM configs_import
+    ON CONFLICT (guild_id) DO UPDATE
+    SET {", ".join(f"{c} = EXCLUDED.{c}" for c in BULK_COLUMNS[1:])},
+        ineligible_since = NULL
+    """
+
+
+class GuildConfig:
+    __slots__ = (
+        "guild_id",
+        "channel_id",
+        "text_begin",
+        "text_end",
+        "region_mask",
+        "webhook_id",
+        "webhook_token",
+        "digest",
+    )
+
+    def __init__(
+        self,
+        guild_id: int,
+        channel_id: int,
+        text_begin: str,
+        text_end: str,
+        regions: Iterable[int] = (),
+        webhook_id: Optional[int] = None,
+        webhook_token: Optional[str] = None,
+        digest: bool = False,
+    ):
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.webhook_id = webhook_id
+        self.webhook_token = webhook_token
+        # merge transitions that arrive close together into one message
+        self.digest = digest
+        # most guilds keep one of a handful of templates
+        self.text_begin = intern(text_begin)
+        self.text_end = intern(text_end)
+        self.region_mask = 0
+        for region_id in regions or ():
+            self.region_mask |= 1 << region_id
+
+    @property
+    def regions(self) -> list[int]:
+        mask = self.region_mask
+        return [i for i in range(mask.bit_length()) if mask >> i & 1]
+
+    def with_regions(self, regions: Iterable[int]) -> "GuildConfig":
+        return GuildConfig(
+            self.guild_id,
+            self.channel_id,
+            self.text_begin,
+            self.text_end,
+            regions,
+            self.webhook_id,
+            self.webhook_token,
+            self.digest,
+        )
+
+    @classmethod
+    def from_record(cls, record: asyncpg.Record) -> "GuildConfig":
+        return cls(
+            record["guild_id"],
+            record["channel_id"],
+            record["text_begin"],
+            record["text_end"],
+            record.get("regions"),
+            record["webhook_id"],
+            record["webhook_token"],
+            record["digest"],
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"GuildConfig({self.guild_id}, {self.channel_id}, "
+            f"{self.text_begin!r}, {self.text_end!r}, {self.regions})"
+        )
+
+
+async def migrate(conn: asyncpg.Connection):
+    async with conn.transaction():
+        await conn.execute("SELECT pg_advisory_xact_lock(hashtext('configs'))")
+        await conn.execute(
+            "CREATE TABLE IF NOT EXISTS schema_version (version INT NOT NULL)"
+        )
+        version = await conn.fetchval("SELECT max(version) FROM schema_version") or 0
+        for migration in MIGRATIONS[version:]:
+            await conn.execute(migration)
+        if version < len(MIGRATIONS):
+            await conn.execute(
+                "INSERT INTO schema_version VALUES ($1)", len(MIGRATIONS)
+            )
+
 
 class ConfigStore:
-    def __init__(self, *args, **kwargs):
-        self.conn: asyncpg.Connection = None
+    def __init__(
+        self,
+        *args,
+        use_index: bool = False,
+        shard_ids: Optional[list[int]] = None,
+        shard_count: int = 1,
+        min_size: int = 2,
+        max_size: int = 10,
+        **kwargs,
+    ):
+        self.pool: asyncpg.Pool = None
         self._args = args
         self._kwargs = kwargs
+        self._pool_size = (min(min_size, max_size), max_size)
+        self._ready = asyncio.Event()
+        self.use_index = use_index
+        # get_for only returns guilds handled by these shards
+        self.shard_ids = (
+            shard_ids if shard_ids is not None else list(range(shard_count))
+        )
+        self.shard_count = shard_count
+        self._configs: Optional[dict[int, GuildConfig]] = None
+        # region_id -> guild_id -> config, None key holds "whole Ukraine"
+        # subscribers
+        self._index: dict[Optional[int], dict[int, GuildConfig]] = {}
+        # region_id -> everyone to notify, rebuilt lazily after writes
+        self._subscribers: dict[int, tuple[GuildConfig, ...]] = {}
+        # guild_id -> config written while load_index was fetching rows
+        self._loading: Optional[dict[int, Optional[GuildConfig]]] = None
+        # LISTENs for bulk writes made by other processes, see notify_changed
+        self._listener: Optional[asyncpg.Connection] = None
+        self._reload: Optional[asyncio.Task] = None
+        self._stale = False
+        # tells our own notifications apart from everyone else's
+        self._token = f"{os.getpid()}:{id(self)}"
 
-    async def _prepare(self):
-        if not self.conn or self.conn.is_closed():
-            self.conn = await asyncpg.connect(*self._args, **self._kwargs)
-            await self.conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS
-                configs (
-                    guild_id VARCHAR(25) PRIMARY KEY,
-                    channel_id VARCHAR(25),
-                    text_begin TEXT,
-                    text_end TEXT,
-                    regions INT ARRAY
-                )
-                """
-            )
+    async def start(self):
+        conn = await asyncpg.connect(*self._args, **self._kwargs)
+        try:
+            await migrate(conn)
+        finally:
+            await conn.close()
+        self.pool = await asyncpg.create_pool(
+            *self._args,
+            min_size=self._pool_size[0],
+            max_size=self._pool_size[1],
+            **self._kwargs,
+        )
+        try:
+            if self.use_index:
+                # before loading, so that no write can fall in between
+                self._listener = await self._listen()
+            await self.load_index()
+        except BaseException:
+            # leave nothing behind for a retry to leak
+            await self._close_listener()
+            await self.pool.close()
+            self.pool = None
+            raise
+        self._ready.set()
+
+    async def close(self):
+        await self._close_listener()
+        if self._reload:
+            self._reload.cancel()
+            await asyncio.gather(self._reload, return_exceptions=True)
+        if self.pool:
+            await self.pool.close()
+
+    async def _listen(self) -> asyncpg.Connection:
+        conn = await asyncpg.connect(*self._args, **self._kwargs)
+        await conn.add_listener(CHANGED, self._changed)
+        conn.add_termination_listener(self._listener_lost)
+        return conn
+
+    async def _close_listener(self):
+        conn, self._listener = self._listener, None
+        if conn:
+            await conn.close()
+
+    def _listener_lost(self, conn: asyncpg.Connection):
+        if conn is not self._listener:
+            return
+        logging.warning("Lost the config change listener, reconnecting")
+        self._listener = None
+        self._changed(conn, 0, CHANGED, None)
+
+    def _changed(self, conn: asyncpg.Connection, pid: int, channel: str, payload):
+        if payload == self._token:
+            return
+        self._stale = True
+        if not self._reload:
+            self._reload = asyncio.create_task(self._reload_index())
+
+    async def _reload_index(self):
+        delay = 1
+        try:
+            while self._stale or not self._listener:
+                try:
+                    if not self._listener:
+                        self._listener = await self._listen()
+                    # a notification during the reload may have missed the
+                    # fetch, so it reloads again
+                    self._stale = False
+                    await self.load_index()
+                    delay = 1
+                except (OSError, asyncpg.PostgresError) as e:
+                    logging.warning(f"Can't reload config index: {e!r}")
+                    self._stale = True
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 60)
+        finally:
+            self._reload = None
+
+    async def notify_changed(self):
+        # asks other processes to reload their index; single-guild writes
+        # don't need it, as they come from the shard that owns the guild
+        await self._run("fetchval", "notify", self._token)
 
-    async def set(self, guild_id: int, channel_id: int, text_begin: str, text_end: str):
-        await self._prepare()
-        await self.conn.execute(
-            """
-            INSERT INTO configs (guild_id, channel_id, text_begin, text_end)
-            VALUES ($1, $2, $3, $4)
-            ON CONFLICT (guild_id) DO UPDATE
-            SET channel_id = $2, text_begin = $3, text_end = $4
-            """,
-            str(guild_id),
-            str(channel_id),
+    async def _run(self, method: str, query: str, *args):
+        await self._ready.wait()
+        async with self.pool.acquire() as conn:
+            # prepared once per connection by asyncpg's statement cache;
+            # statements prepared by hand don't survive a release to the pool
+            return await getattr(conn, method)(QUERIES[query], *args)
+
+    async def load_index(self):
+        if not self.use_index:
+            return
+        # writes made while the rows are fetched are replayed on top of them
+        self._loading = loading = {}
+        try:
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch(QUERIES["get_all"])
+        finally:
+            if self._loading is loading:
+                self._loading = None
+        # filled without yielding, so lookups never see a partial index
+        self._configs = {}
+        self._index = {}
+        self._subscribers = {}
+        for row in rows:
+            self._update_index(row["guild_id"], GuildConfig.from_record(row))
+        for guild_id, config in loading.items():
+            self._update_index(guild_id, config)
+
+    def owns(self, guild_id: int) -> bool:
+        return (guild_id >> 22) % self.shard_count in self.shard_ids
+
+    def _update_index(self, guild_id: int, config: Optional[GuildConfig]):
+        if self._configs is None or not self.owns(guild_id):
+            return
+        if self._loading is not None:
+            self._loading[guild_id] = config
+        old = self._configs.pop(guild_id, None)
+        if old:
+            for region_id in old.regions or (None,):
+                bucket = self._index[region_id]
+                del bucket[guild_id]
+                if not bucket:
+                    del self._index[region_id]
+                self._invalidate(region_id)
+        if config:
+            self._configs[guild_id] = config
+            for region_id in config.regions or (None,):
+                self._index.setdefault(region_id, {})[guild_id] = config
+                self._invalidate(region_id)
+
+    def _invalidate(self, region_id: Optional[int]):
+        if region_id is None:
+            self._subscribers.clear()
+        else:
+            self._subscribers.pop(region_id, None)
+
+    async def set(
+        self,
+        guild_id: int,
+        channel_id: int,
+        text_begin: str,
+        text_end: str,
+        webhook_id: Optional[int] = None,
+        webhook_token: Optional[str] = None,
+        digest: bool = False,
+    ):
+        regions = await self._run(
+            "fetchval",
+            "set",
+            guild_id,
+            channel_id,
             text_begin,
             text_end,
+            webhook_id,
+            webhook_token,
+            digest,
         )
-
-    async def get(self, guild_id: int) -> Optional[RowWithRegions]:
-        await self._prepare()
-        row = await self.conn.fetchrow(
-            """
-            SELECT channel_id, text_begin, text_end, regions FROM configs
-            WHERE guild_id = $1
-            """,
-            str(guild_id),
+        self._update_index(
+            guild_id,
+            GuildConfig(
+                guild_id,
+                channel_id,
+                text_begin,
+                text_end,
+                regions,
+                webhook_id,
+                webhook_token,
+                digest,
+            ),
         )
+
+    async def get(self, guild_id: int) -> Optional[GuildConfig]:
+        if self._configs is not None:
+            return self._configs.get(guild_id)
+        row = await self._run("fetchrow", "get", guild_id)
         if row:
-            return (
-                int(row["channel_id"]),
+            return GuildConfig(
+                guild_id,
+                row["channel_id"],
                 row["text_begin"],
                 row["text_end"],
                 row["regions"],
+                row["webhook_id"],
+                row["webhook_token"],
+                row["digest"],
             )
         return None
 
     async def delete(self, guild_id: int):
-        await self._prepare()
-        await self.conn.execute(
-            "DELETE FROM configs WHERE guild_id = $1",
-            str(guild_id),
-        )
+        await self._run("fetch", "delete", guild_id)
+        self._update_index(guild_id, None)
 
-    async def get_for(self, region_id: int) -> list[Row]:
-        await self._prepare()
-        return [
-            (int(row["channel_id"]), row["text_begin"], row["text_end"])
-            for row in await self.conn.fetch(
-                """
-                SELECT channel_id, text_begin, text_end FROM configs
-                WHERE
-                    array_length(regions, 1) IS NULL
-                    OR array_position(regions, $1) IS NOT NULL
-                """,
-                region_id,
+    async def get_for(self, region_id: int) -> tuple[GuildConfig, ...]:
+        if self._configs is not None:
+            subscribers = self._subscribers.get(region_id)
+            if subscribers is None:
+                subscribers = self._subscribers[region_id] = (
+                    *self._index.get(None, {}).values(),
+                    *self._index.get(region_id, {}).values(),
+                )
+            return subscribers
+        return tuple(
+            GuildConfig.from_record(row)
+            for row in await self._run(
+                "fetch", "get_for", region_id, self.shard_count, self.shard_ids
             )
-        ]
+        )
 
     async def add_region(self, guild_id: int, region_id: int):
-        await self._prepare()
-        return (
-            await self.conn.execute(
-                """
-                UPDATE configs
-                SET regions = array_append(regions, $2)
-                WHERE guild_id = $1 AND array_position(regions, $2) IS NULL
-                """,
-                str(guild_id),
-                region_id,
-            )
-        ).endswith("1")
+        regions = await self._run("fetchval", "add_region", guild_id, region_id)
+        if regions is None:
+            return False
+        self._set_regions(guild_id, regions)
+        return True
 
     async def remove_region(self, guild_id: int, region_id: int):
-        await self._prepare()
-        return (
-            await self.conn.execute(
-                """
-                UPDATE configs
-                SET regions = array_remove(regions, $2)
-                WHERE guild_id = $1 AND array_position(regions, $2) IS NOT NULL
-                """,
-                str(guild_id),
-                region_id,
-            )
-        ).endswith("1")
+        regions = await self._run("fetchval", "remove_region", guild_id, region_id)
+        if regions is None:
+            return False
+        self._set_regions(guild_id, regions)
+        return True
 
     async def remove_all_regions(self, guild_id: int):
-        await self._prepare()
-        await self.conn.execute(
-            "UPDATE configs SET regions = $2 WHERE guild_id = $1", str(guild_id), []
+        await self._run("fetch", "remove_all_regions", guild_id, [])
+        self._set_regions(guild_id, [])
+
+    async def clear_webhook(self, guild_id: int, webhook_id: int):
+        regions = await self._run("fetchval", "clear_webhook", guild_id, webhook_id)
+        if regions is None or self._configs is None or guild_id not in self._configs:
+            return
+        config = self._configs[guild_id]
+        self._update_index(
+            guild_id,
+            GuildConfig(
+                guild_id,
+                config.channel_id,
+                config.text_begin,
+                config.text_end,
+                regions,
+                digest=config.digest,
+            ),
         )
+
+    async def channels(self) -> list[tuple[int, int, Optional[int]]]:
+        if self._configs is not None:
+            return [
+                (c.guild_id, c.channel_id, c.webhook_id) for c in self._configs.values()
+            ]
+        rows = await self._run(
+            "fetch", "get_channels", self.shard_count, self.shard_ids
+        )
+        return [(row["guild_id"], row["channel_id"], row["webhook_id"]) for row in rows]
+
+    async def prune(
+        self, ineligible: list[int], eligible: list[int], after: float
+    ) -> list[int]:
+        await self._run("fetch", "mark_ineligible", ineligible)
+        await self._run("fetch", "mark_eligible", eligible)
+        rows = await self._run(
+            "fetch", "prune", after, self.shard_count, self.shard_ids
+        )
+        for row in rows:
+            self._update_index(row["guild_id"], None)
+        return [row["guild_id"] for row in rows]
+
+    async def add_region_many(self, guild_ids: list[int], region_id: int) -> int:
+        rows = await self._run("fetch", "add_region_many", guild_ids, region_id)
+        for row in rows:
+            self._set_regions(row["guild_id"], row["regions"])
+        await self.notify_changed()
+        return len(rows)
+
+    async def remove_region_many(self, guild_ids: list[int], region_id: int) -> int:
+        rows = await self._run("fetch", "remove_region_many", guild_ids, region_id)
+        for row in rows:
+            self._set_regions(row["guild_id"], row["regions"])
+        await self.notify_changed()
+        return len(rows)
+
+    async def delete_many(self, guild_ids: list[int]) -> int:
+        rows = await self._run("fetch", "delete_many", guild_ids)
+        for row in rows:
+            self._update_index(row["guild_id"], None)
+        await self.notify_changed()
+        return len(rows)
+
+    async def export_configs(
+        self, output: Union[str, Callable[[bytes], Awaitable[Any]]]
+    ) -> int:
+        # binary COPY: no per-row round trips and no text parsing
+        await self._ready.wait()
+        async with self.pool.acquire() as conn:
+            status = await conn.copy_from_query(
+                f"SELECT {', '.join(BULK_COLUMNS)} FROM configs ORDER BY guild_id",
+                output=output,
+                format="binary",
+            )
+        return int(status.split()[-1])
+
+    async def import_configs(
+        self, source: Union[str, AsyncIterable[bytes]], replace: bool = False
+    ) -> int:
+        return await self._bulk_upsert(
+            lambda conn: conn.copy_to_table(
+                "configs_import", source=source, columns=BULK_COLUMNS, format="binary"
+            ),
+            replace,
+        )
+
+    async def set_many(self, configs: Iterable[GuildConfig]) -> int:
+        return await self._bulk_upsert(
+            lambda conn: conn.copy_records_to_table(
+                "configs_import",
+                records=(
+                    (
+                        c.guild_id,
+                        c.channel_id,
+                        c.text_begin,
+                        c.text_end,
+                        list(c.regions),
+                        c.webhook_id,
+                        c.webhook_token,
+                        c.digest,
+                    )
+                    for c in configs
+                ),
+                columns=BULK_COLUMNS,
+            )
+        )
+
+    async def _bulk_upsert(
+        self, copy: Callable[[asyncpg.Connection], Awaitable], replace: bool = False
+    ) -> int:
+        # staged in a temporary table so that the upsert is one statement
+        await self._ready.wait()
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(BULK_STAGE)
+                await copy(conn)
+                if replace:
+                    await conn.execute(BULK_REPLACE)
+                status = await conn.execute(BULK_UPSERT)
+                # delivered on commit
+                await conn.fetchval(QUERIES["notify"], self._token)
+        await self.load_index()
+        return int(status.split()[-1])
+
+    def _set_regions(self, guild_id: int, regions: list[int]):
+        if self._configs is not None and guild_id in self._configs:
+            self._update_index(guild_id, self._configs[guild_id].with_regions(regions))
@@ -0,0 +1,79 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+from .db import GuildConfig
+
+
+def merge_states(states: list[dict]) -> dict:
+    data = dict(states[-1])
+    data["names"] = data["name"] = ", ".join(s["name"] for s in states)
+    data["names_en"] = data["name_en"] = ", ".join(s["name_en"] for s in states)
+    return data
+
+
+class Pending:
+    __slots__ = ("config", "received", "states", "timer")
+
+    def __init__(self, config: GuildConfig, received: float):
+        self.config = config
+        # when the first transition of the digest was received
+        self.received = received
+        # region id -> latest state, in the order regions were first seen
+        self.states: dict[int, dict] = {}
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class DigestBuffer:
+    def __init__(
+        self,
+        send: Callable[[GuildConfig, dict, float], Awaitable],
+        window: float = 3,
+    ):
+        self.send = send
+        self.window = window
+        self._pending: dict[int, Pending] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def add(self, config: GuildConfig, data: dict, received: float):
+        pending = self._pending.get(config.channel_id)
+        if pending is None:
+            pending = self._pending[config.channel_id] = Pending(config, received)
+            pending.timer = asyncio.get_running_loop().call_later(
+                self.window, self._flush, config.channel_id
+            )
+        # a config edited during the window applies to the whole digest
+        pending.config = config
+        # a region that flipped again within the window only reports its latest
+        # state
+        pending.states[data["id"]] = data
+
+    def _flush(self, channel_id: int):
+        pending = self._pending.pop(channel_id)
+        groups: dict[bool, list[dict]] = {}
+        for state in pending.states.values():
+            groups.setdefault(state["alert"], []).append(state)
+        for states in groups.values():
+            task = asyncio.create_task(
+                self.send(pending.config, merge_states(states), pending.received)
+            )
+            self._tasks.add(task)
+            task.add_done_callback(self._done)
+
+    def _done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logging.error(task.exception())
+
+    async def close(self):
+        for pending in self._pending.values():
+            pending.timer.cancel()
+        self._pending.clear()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
@@ -0,0 +1,118 @@
+import asyncio
+from collections import deque
+from itertools import count
+from time import monotonic
+from typing import Awaitable, Callable, Hashable, Optional
+
+from .metrics import metrics
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = monotonic()
+
+    async def acquire(self):
+        while True:
+            now = monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Job:
+    __slots__ = ("created", "send", "future", "stage")
+
+    def __init__(self, created: float, send: Callable[[], Awaitable], stage: str):
+        self.created = created
+        self.send = send
+        self.stage = stage
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class Dispatcher:
+    def __init__(self, concurrency: int = 8, rate: float = 45.0):
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate)
+        self._queue: asyncio.PriorityQueue[tuple[float, int, Hashable]] = (
+            asyncio.PriorityQueue()
+        )
+        self._jobs: dict[Hashable, Job] = {}
+        self._seq = count()
+        self._workers: list[asyncio.Task] = []
+        self.sent = 0
+        self.coalesced = 0
+        self.delays: deque[float] = deque(maxlen=1000)
+
+    @property
+    def depth(self) -> int:
+        return len(self._jobs)
+
+    def start(self):
+        if not self._workers:
+            self._workers = [
+                asyncio.create_task(self._work()) for _ in range(self.concurrency)
+            ]
+
+    async def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for job in self._jobs.values():
+            job.future.cancel()
+        self._jobs.clear()
+
+    def submit(
+        self,
+        key: Hashable,
+        created: float,
+        send: Callable[[], Awaitable],
+        stage: str = "send",
+    ) -> asyncio.Future:
+        job = Job(created, send, stage)
+        old = self._jobs.get(key)
+        self._jobs[key] = job
+        if old:
+            # superseded by a newer state for the same target before being sent
+            old.future.set_result(None)
+            self.coalesced += 1
+            metrics.count("coalesced", job.stage)
+        else:
+            self._queue.put_nowait((created, next(self._seq), key))
+        return job.future
+
+    async def _work(self):
+        while True:
+            _, _, key = await self._queue.get()
+            job = self._jobs.pop(key)
+            await self.bucket.acquire()
+            try:
+                result = await job.send()
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                if not job.future.done():
+                    job.future.set_result(result)
+            self.sent += 1
+            delay = monotonic() - job.created
+            self.delays.append(delay)
+            metrics.observe(job.stage, delay)
+
+    def stats(self) -> dict[str, float]:
+        delays = sorted(self.delays)
+        return {
+            "depth": self.depth,
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "delay_p50": delays[len(delays) // 2] if delays else 0,
+            "delay_max": delays[-1] if delays else 0,
+        }
@@ -0,0 +1,66 @@
+from time import time
+from typing import Optional
+
+import discord
+
+
+class Eligibility:
+    __slots__ = ("channel", "reason", "embed_links", "expires")
+
+    def __init__(
+        self,
+        channel: Optional[discord.abc.GuildChannel],
+        reason: Optional[str],
+        embed_links: bool = False,
+        expires: Optional[float] = None,
+    ):
+        self.channel = channel
+        # why nothing can be sent to the channel, None if it can
+        self.reason = reason
+        self.embed_links = embed_links
+        # wall time the entry goes stale without a gateway event
+        self.expires = expires
+
+
+class EligibilityCache:
+    def __init__(self, client: discord.Client):
+        self.client = client
+        self._cache: dict[int, Eligibility] = {}
+        # guild id -> cached channel ids, to invalidate a whole guild
+        self._guilds: dict[int, set[int]] = {}
+
+    def get(self, guild_id: int, channel_id: int) -> Eligibility:
+        entry = self._cache.get(channel_id)
+        if entry is None or (entry.expires is not None and entry.expires <= time()):
+            entry = self._cache[channel_id] = self._check(guild_id, channel_id)
+            self._guilds.setdefault(guild_id, set()).add(channel_id)
+        return entry
+
+    def _check(self, guild_id: int, channel_id: int) -> Eligibility:
+        # Client.get_channel scans every guild, Guild.get_channel doesn't
+        guild = self.client.get_guild(guild_id)
+        channel = guild and guild.get_channel(channel_id)
+        if not channel:
+            return Eligibility(None, "missing_channel")
+        me = guild.me
+        if me.timed_out:
+            return Eligibility(
+                channel,
+                "timed_out",
+                expires=me.communication_disabled_until.timestamp(),
+            )
+        perms = channel.permissions_for(me)
+        if not perms.send_messages:
+            return Eligibility(channel, "no_permissions")
+        return Eligibility(channel, None, perms.embed_links)
+
+    def invalidate_channel(self, channel_id: int):
+        self._cache.pop(channel_id, None)
+
+    def invalidate_guild(self, guild_id: int):
+        for channel_id in self._guilds.pop(guild_id, ()):
+            self._cache.pop(channel_id, None)
+
+    def clear(self):
+        self._cache.clear()
+        self._guilds.clear()
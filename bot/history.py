@@ -0,0 +1,140 @@
+import logging
+import os
+import struct
+from array import array
+from bisect import bisect_left
+from time import time
+from typing import BinaryIO, Iterator, Optional
+
+# region id, alert, unix time
+RECORD = struct.Struct("<H?d")
+
+
+class RegionLog:
+    __slots__ = ("times", "alerts")
+
+    def __init__(self):
+        # parallel arrays, sorted by time
+        self.times = array("d")
+        self.alerts = bytearray()
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def append(self, alert: bool, timestamp: float):
+        self.times.append(timestamp)
+        self.alerts.append(alert)
+
+
+class AlertHistory:
+    def __init__(self, path: Optional[str] = None, retention: float = 30 * 86400):
+        self.path = path
+        self.retention = retention
+        # region id -> (alert, since)
+        self.states: dict[int, tuple[bool, float]] = {}
+        self._logs: dict[int, RegionLog] = {}
+        self._file: Optional[BinaryIO] = None
+        self._records = 0
+
+    def __len__(self) -> int:
+        return self._records
+
+    def active(self) -> list[tuple[int, float]]:
+        return sorted(
+            (
+                (region_id, since)
+                for region_id, (alert, since) in self.states.items()
+                if alert
+            ),
+            key=lambda item: item[1],
+        )
+
+    def append(self, region_id: int, alert: bool, timestamp: Optional[float] = None):
+        state = self.states.get(region_id)
+        if state and state[0] == alert:
+            return
+        timestamp = timestamp or time()
+        # upstream clocks may disagree slightly, keep every log sorted
+        if state and timestamp < state[1]:
+            timestamp = state[1]
+        self._add(region_id, alert, timestamp)
+        if self.path:
+            if not self._file:
+                self._file = open(self.path, "ab", buffering=0)
+            self._file.write(RECORD.pack(region_id, alert, timestamp))
+
+    def _add(self, region_id: int, alert: bool, timestamp: float):
+        self.states[region_id] = (alert, timestamp)
+        log = self._logs.get(region_id)
+        if log is None:
+            log = self._logs[region_id] = RegionLog()
+        log.append(alert, timestamp)
+        self._records += 1
+
+    def history(
+        self, region_id: int, since: float = 0, limit: Optional[int] = None
+    ) -> list[tuple[bool, float]]:
+        log = self._logs.get(region_id)
+        if not log:
+            return []
+        start = bisect_left(log.times, since)
+        if limit is not None:
+            start = max(start, len(log) - limit)
+        return [(bool(log.alerts[i]), log.times[i]) for i in range(start, len(log))]
+
+    def _read(self) -> Iterator[tuple[int, bool, float]]:
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            # a crash mid-write can leave a partial record at the end, which
+            # would shift every record appended after it
+            usable = len(data) - len(data) % RECORD.size
+            if usable < len(data):
+                f.truncate(usable)
+        return RECORD.iter_unpack(memoryview(data)[:usable])
+
+    def load(self) -> bool:
+        if not self.path:
+            return False
+        try:
+            records = self._read()
+        except OSError as e:
+            logging.warning(f"Can't read alert history: {e}")
+            return False
+        for region_id, alert, timestamp in records:
+            state = self.states.get(region_id)
+            if not state or state[0] != alert:
+                self._add(region_id, alert, timestamp)
+        return True
+
+    def compact(self):
+        # drops records older than the retention period, but keeps the one
+        # that set each region's current state
+        limit = time() - self.retention
+        logs: dict[int, RegionLog] = {}
+        for region_id, log in self._logs.items():
+            start = max(min(bisect_left(log.times, limit), len(log) - 1), 0)
+            kept = logs[region_id] = RegionLog()
+            kept.times = log.times[start:]
+            kept.alerts = log.alerts[start:]
+        records = sum(map(len, logs.values()))
+        if records == self._records:
+            return
+        if self.path:
+            tmp = self.path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(
+                    b"".join(
+                        RECORD.pack(region_id, bool(log.alerts[i]), log.times[i])
+                        for region_id, log in logs.items()
+                        for i in range(len(log))
+                    )
+                )
+            self.close()
+            os.replace(tmp, self.path)
+        self._logs = logs
+        self._records = records
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,319 @@
+import asyncio
+import json
+import logging
+import os
+from functools import partial
+from hashlib import blake2b
+from time import monotonic, time
+from typing import Awaitable, Callable, Iterator, Optional
+
+import discord
+
+from .dispatch import Dispatcher
+from .metrics import metrics
+from .templates import PLACEHOLDER, compile_template
+
+# webhook id and token, for messages sent through a webhook
+Webhook = Optional[tuple[int, str]]
+# sent at, channel id, template hash, alert data, webhook
+Tracked = tuple[float, int, str, dict, Webhook]
+
+
+def template_hash(template: str) -> str:
+    return blake2b(template.encode(), digest_size=8).hexdigest()
+
+
+class MessageTracker:
+    def __init__(
+        self,
+        size: int = 10000,
+        max_age: float = 3600,
+        snapshot_path: Optional[str] = None,
+    ):
+        self.size = size
+        self.max_age = max_age
+        self.snapshot_path = snapshot_path
+        # oldest first, so expiry only looks at the head
+        self._entries: dict[int, Tracked] = {}
+        self._templates: dict[str, str] = {}
+        # template hash -> placeholders it uses
+        self._fields: dict[str, tuple[str, ...]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, message_id: int) -> bool:
+        return message_id in self._entries
+
+    def __iter__(self) -> Iterator[tuple[int, Tracked]]:
+        return iter(self._entries.items())
+
+    def get(self, message_id: int) -> Optional[Tracked]:
+        return self._entries.get(message_id)
+
+    def template(self, key: str) -> Optional[str]:
+        return self._templates.get(key)
+
+    def add(
+        self,
+        channel_id: int,
+        message_id: int,
+        template: str,
+        data: dict,
+        sent: Optional[float] = None,
+        webhook: Webhook = None,
+    ):
+        key = template_hash(template)
+        self._templates.setdefault(key, template)
+        fields = self._fields.get(key)
+        if fields is None:
+            fields = self._fields[key] = tuple(set(PLACEHOLDER.findall(template)))
+        # only what the template needs, not the whole alert state
+        data = {name: data[name] for name in fields if name in data}
+        self._entries.pop(message_id, None)
+        self._entries[message_id] = (sent or time(), channel_id, key, data, webhook)
+        self.expire()
+
+    def discard(self, message_id: int):
+        self._entries.pop(message_id, None)
+
+    def expire(self):
+        limit = time() - self.max_age
+        while self._entries:
+            message_id, (sent, *_) = next(iter(self._entries.items()))
+            if len(self._entries) <= self.size and sent >= limit:
+                break
+            del self._entries[message_id]
+        if len(self._templates) > len(self._entries):
+            used = {entry[2] for entry in self._entries.values()}
+            self._templates = {k: v for k, v in self._templates.items() if k in used}
+            self._fields = {k: v for k, v in self._fields.items() if k in used}
+
+    def load(self) -> bool:
+        if not self.snapshot_path:
+            return False
+        try:
+            with open(self.snapshot_path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Can't read message tracker snapshot: {e}")
+            return False
+        templates = snapshot["templates"]
+        for message_id, sent, channel_id, key, data, *webhook in snapshot["messages"]:
+            if key in templates:
+                webhook = tuple(webhook[0]) if webhook and webhook[0] else None
+                self.add(channel_id, message_id, templates[key], data, sent, webhook)
+        return True
+
+    def snapshot(self) -> dict:
+        # copied, so that it can be written from another thread
+        self.expire()
+        return {
+            "templates": dict(self._templates),
+            "messages": [
+                (i, sent, channel_id, key, dict(data), webhook)
+                for i, (sent, channel_id, key, data, webhook) in self._entries.items()
+            ],
+        }
+
+    def write(self, snapshot: dict):
+        tmp = self.snapshot_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp, self.snapshot_path)
+
+    def save(self):
+        if self.snapshot_path:
+            self.write(self.snapshot())
+
+
+class Entry:
+    __slots__ = ("channel_id", "message_id", "not_before", "follow_up")
+
+    def __init__(
+        self,
+        channel_id: int,
+        message_id: int,
+        not_before: Optional[float],
+        follow_up: bool,
+    ):
+        self.channel_id = channel_id
+        self.message_id = message_id
+        # the map must be rendered at or after this monotonic time
+        self.not_before = not_before
+        self.follow_up = follow_up
+
+
+class MapRefresher:
+    def __init__(
+        self,
+        get_url: Callable[[Optional[float]], Awaitable[Optional[str]]],
+        get_message: Callable[[int, int, Webhook], discord.PartialMessage],
+        dispatcher: Dispatcher,
+        tracker: Optional[MessageTracker] = None,
+        debounce: float = 5,
+        max_staleness: float = 30,
+        follow_up: float = 30,
+        save_interval: float = 10,
+    ):
+        self.get_url = get_url
+        self.get_message = get_message
+        self.dispatcher = dispatcher
+        self.tracker = tracker if tracker is not None else MessageTracker()
+        self.debounce = debounce
+        self.max_staleness = max_staleness
+        self.follow_up = follow_up
+        self.save_interval = save_interval
+        self._pending: dict[int, Entry] = {}
+        self._first_added = 0.0
+        self._last_added = 0.0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._timers: set[asyncio.TimerHandle] = set()
+        self._save_timer: Optional[asyncio.TimerHandle] = None
+        self._saving: Optional[asyncio.Future] = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def start(self):
+        if self._task:
+            return
+        # messages sent before a restart get one more refresh
+        if self.tracker.load():
+            for message_id, (_, channel_id, *_) in self.tracker:
+                self._add(Entry(channel_id, message_id, None, False))
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        for timer in self._timers:
+            timer.cancel()
+        self._timers.clear()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._save_timer:
+            self._save_timer.cancel()
+            self._save_timer = None
+        if self._saving:
+            await asyncio.gather(self._saving, return_exceptions=True)
+        self.tracker.save()
+
+    def _schedule_save(self):
+        if self.tracker.snapshot_path and not self._save_timer:
+            self._save_timer = asyncio.get_running_loop().call_later(
+                self.save_interval, self._save
+            )
+
+    def _save(self):
+        self._save_timer = None
+        if self._saving and not self._saving.done():
+            self._schedule_save()
+            return
+        # serializing thousands of entries would stall the loop mid-wave
+        self._saving = asyncio.get_running_loop().run_in_executor(
+            None, self.tracker.write, self.tracker.snapshot()
+        )
+        self._saving.add_done_callback(self._saved)
+
+    def _saved(self, future: asyncio.Future):
+        if not future.cancelled() and future.exception():
+            logging.error(f"Can't save message tracker: {future.exception()!r}")
+
+    def add(
+        self,
+        channel_id: int,
+        message_id: int,
+        template: str,
+        data: dict,
+        not_before: Optional[float] = None,
+        follow_up: bool = True,
+        webhook: Webhook = None,
+    ):
+        self.tracker.add(channel_id, message_id, template, data, webhook=webhook)
+        self._add(Entry(channel_id, message_id, not_before, follow_up))
+
+    def _add(self, entry: Entry):
+        now = monotonic()
+        if not self._pending:
+            self._first_added = now
+        self._last_added = now
+        self._pending[entry.message_id] = entry
+        self._wakeup.set()
+
+    def _schedule_follow_up(self, entries: list[Entry]):
+        def add():
+            self._timers.discard(timer)
+            now = monotonic()
+            for entry in entries:
+                if entry.message_id not in self._pending:
+                    entry.not_before = now
+                    entry.follow_up = False
+                    self._add(entry)
+
+        timer = asyncio.get_running_loop().call_later(self.follow_up, add)
+        self._timers.add(timer)
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while True:
+                deadline = min(
+                    self._last_added + self.debounce,
+                    self._first_added + self.max_staleness,
+                )
+                timeout = deadline - monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                self._wakeup.clear()
+            batch, self._pending = list(self._pending.values()), {}
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                logging.error(e)
+
+    async def _flush(self, batch: list[Entry]):
+        self.tracker.expire()
+        # entries that aged out of the tracker are dropped without an edit
+        batch = [e for e in batch if e.message_id in self.tracker]
+        if not batch:
+            return
+        not_before = [e.not_before for e in batch if e.not_before is not None]
+        url = await self.get_url(max(not_before) if not_before else None)
+        if not url:
+            return
+        # the wait for the map may have let newer messages evict some entries
+        batch = [e for e in batch if e.message_id in self.tracker]
+        futures = []
+        for entry in batch:
+            _, _, key, data, webhook = self.tracker.get(entry.message_id)
+            msg, embed = compile_template(self.tracker.template(key)).render(
+                dict(data, map=url)
+            )
+            message = self.get_message(entry.channel_id, entry.message_id, webhook)
+            futures.append(
+                self.dispatcher.submit(
+                    ("edit", entry.message_id),
+                    monotonic(),
+                    partial(message.edit, content=msg, embed=embed),
+                    "edit",
+                )
+            )
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        for entry, result in zip(batch, results):
+            if isinstance(result, Exception):
+                logging.error(result)
+                metrics.count("edit_failed", type(result).__name__)
+            if not entry.follow_up or isinstance(result, discord.NotFound):
+                self.tracker.discard(entry.message_id)
+        follow_ups = [e for e in batch if e.follow_up and e.message_id in self.tracker]
+        if follow_ups:
+            self._schedule_follow_up(follow_ups)
+        self._schedule_save()
@@ -0,0 +1,171 @@
+import asyncio
+import json
+import logging
+from bisect import bisect_left
+from collections import Counter
+from time import perf_counter
+from typing import TYPE_CHECKING, Callable, Optional
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        # upper bound of the bucket holding the q-th observation
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class _Timer:
+    __slots__ = ("metrics", "stage", "start")
+
+    def __init__(self, metrics: "Metrics", stage: str):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.stage, perf_counter() - self.start)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    def __init__(self, prefix: str = "air_alarm"):
+        self.prefix = prefix
+        self.enabled = False
+        self.histograms: dict[str, Histogram] = {}
+        self.counters: Counter[tuple[str, str]] = Counter()
+        self.gauges: dict[str, Callable[[], float]] = {}
+        self._tasks: list[asyncio.Task] = []
+        self._runner: Optional["web.AppRunner"] = None
+
+    def observe(self, stage: str, seconds: float):
+        if not self.enabled:
+            return
+        histogram = self.histograms.get(stage)
+        if not histogram:
+            histogram = self.histograms[stage] = Histogram()
+        histogram.observe(seconds)
+
+    def timer(self, stage: str):
+        return _Timer(self, stage) if self.enabled else _NULL_TIMER
+
+    def count(self, name: str, reason: str = "", value: int = 1):
+        if self.enabled:
+            self.counters[name, reason] += value
+
+    def gauge(self, name: str, func: Callable[[], float]):
+        self.gauges[name] = func
+
+    def render(self) -> str:
+        lines = []
+        for stage, h in sorted(self.histograms.items()):
+            name = f"{self.prefix}_{stage}_seconds"
+            lines.append(f"# TYPE {name} histogram")
+            total = 0
+            for bound, n in zip((*BUCKETS, "+Inf"), h.counts):
+                total += n
+                lines.append(f'{name}_bucket{{le="{bound}"}} {total}')
+            lines.append(f"{name}_sum {h.sum}")
+            lines.append(f"{name}_count {h.count}")
+        for name in sorted({name for name, _ in self.counters}):
+            full = f"{self.prefix}_{name}_total"
+            lines.append(f"# TYPE {full} counter")
+            for (n, reason), value in sorted(self.counters.items()):
+                if n == name:
+                    label = f'{{reason="{reason}"}}' if reason else ""
+                    lines.append(f"{full}{label} {value}")
+        for name, func in sorted(self.gauges.items()):
+            full = f"{self.prefix}_{name}"
+            lines.append(f"# TYPE {full} gauge")
+            lines.append(f"{full} {func()}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> dict:
+        return {
+            "stages": {
+                stage: {
+                    "count": h.count,
+                    "avg": h.sum / h.count if h.count else 0,
+                    "p50": h.quantile(0.5),
+                    "p99": h.quantile(0.99),
+                }
+                for stage, h in self.histograms.items()
+            },
+            "counters": {
+                f"{name}:{reason}" if reason else name: value
+                for (name, reason), value in self.counters.items()
+            },
+            "gauges": {name: func() for name, func in self.gauges.items()},
+        }
+
+    async def start(self, port: Optional[int] = None, log_interval: float = 0):
+        if port:
+            from aiohttp import web
+
+            app = web.Application()
+            app.router.add_get("/metrics", self._handle)
+            self._runner = web.AppRunner(app)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, port=port).start()
+        if log_interval:
+            self._tasks.append(asyncio.create_task(self._log(log_interval)))
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, request: "web.Request") -> "web.Response":
+        from aiohttp import web
+
+        return web.Response(text=self.render(), content_type="text/plain")
+
+    async def _log(self, interval: float):
+        logger = logging.getLogger("metrics")
+        logger.setLevel(logging.INFO)
+        while True:
+            await asyncio.sleep(interval)
+            logger.info(json.dumps(self.summary()))
+
+
+metrics = Metrics()
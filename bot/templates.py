@@ -0,0 +1,79 @@
+import json
+import re
+from functools import lru_cache
+from os import getenv
+from typing import Optional, Union
+
+import discord
+
+
+PLACEHOLDER = re.compile(r"%(\w+)%")
+
+
+class Slots(tuple):
+    # PLACEHOLDER.split() result: literals at even positions, names at odd ones
+    def render(self, data: dict, strict: bool) -> str:
+        return "".join(
+            (part if i % 2 == 0 else data.get(part, f"%{part}%" if strict else ""))
+            for i, part in enumerate(self)
+        )
+
+
+Node = Union[str, Slots, dict, list, int, float, bool, None]
+
+
+def _compile(node) -> Node:
+    if isinstance(node, str):
+        parts = PLACEHOLDER.split(node)
+        return Slots(parts) if len(parts) > 1 else node
+    if isinstance(node, dict):
+        return {k: _compile(v) for k, v in node.items()}
+    if isinstance(node, list):
+        return [_compile(v) for v in node]
+    return node
+
+
+def _render(node: Node, data: dict, strict: bool):
+    if isinstance(node, Slots):
+        return node.render(data, strict)
+    if isinstance(node, dict):
+        return {k: _render(v, data, strict) for k, v in node.items()}
+    if isinstance(node, list):
+        return [_render(v, data, strict) for v in node]
+    return node
+
+
+class Template:
+    __slots__ = ("content", "embed")
+
+    def __init__(self, source: str):
+        try:
+            data = json.loads(source)
+        except json.JSONDecodeError:
+            data = None
+        if isinstance(data, dict):
+            embed = data.get("embed") or (
+                data["embeds"][0] if data.get("embeds") else None
+            )
+            self.content = _compile(data.get("content", ""))
+            self.embed = _compile(embed) if embed else None
+        else:
+            self.content = _compile(source)
+            self.embed = None
+
+    def render(
+        self, data: dict, strict: bool = False
+    ) -> tuple[str, Optional[discord.Embed]]:
+        return (
+            _render(self.content, data, strict),
+            (
+                discord.Embed.from_dict(_render(self.embed, data, strict))
+                if self.embed
+                else None
+            ),
+        )
+
+
+@lru_cache(maxsize=int(getenv("TEMPLATE_CACHE_SIZE", 1024)))
+def compile_template(source: str) -> Template:
+    return Template(source)
@@ -0,0 +1,58 @@
+from typing import Optional
+
+import aiohttp
+import discord
+
+
+class PartialWebhookMessage:
+    __slots__ = ("webhook", "id")
+
+    def __init__(self, webhook: discord.Webhook, message_id: int):
+        self.webhook = webhook
+        self.id = message_id
+
+    async def edit(self, **fields) -> discord.WebhookMessage:
+        return await self.webhook.edit_message(self.id, **fields)
+
+
+class WebhookSender:
+    def __init__(self, connections: int = 100, keepalive: float = 60):
+        self.connections = connections
+        self.keepalive = keepalive
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # one keep-alive pool for every webhook; py-cord keeps a lock per
+        # webhook on top of it and follows each webhook's rate limit bucket
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.connections, keepalive_timeout=self.keepalive
+                )
+            )
+        return self._session
+
+    async def close(self):
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    def webhook(self, webhook_id: int, token: str) -> discord.Webhook:
+        return discord.Webhook.partial(webhook_id, token, session=self.session)
+
+    async def send(
+        self,
+        webhook_id: int,
+        token: str,
+        content: Optional[str],
+        embed: Optional[discord.Embed],
+    ) -> discord.WebhookMessage:
+        return await self.webhook(webhook_id, token).send(
+            content=content, embed=embed, wait=True
+        )
+
+    def get_partial_message(
+        self, webhook_id: int, token: str, message_id: int
+    ) -> PartialWebhookMessage:
+        return PartialWebhookMessage(self.webhook(webhook_id, token), message_id)
@@ -0,0 +1,60 @@
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+MAIN = Path(__file__).with_name("main.py")
+
+
+def split_shards(shard_count: int, processes: int) -> list[list[int]]:
+    processes = min(processes, shard_count)
+    return [list(range(i, shard_count, processes)) for i in range(processes)]
+
+
+def spawn(shard_ids: list[int], shard_count: int) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        SHARD_COUNT=str(shard_count),
+        SHARD_IDS=",".join(map(str, shard_ids)),
+    )
+    return subprocess.Popen([sys.executable, str(MAIN)], env=env)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="run the bot as sharded processes")
+    parser.add_argument("--shards", type=int, required=True, help="total shards")
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    groups = split_shards(args.shards, args.processes or args.shards)
+    children = {i: spawn(ids, args.shards) for i, ids in enumerate(groups)}
+    backoff = {i: 1.0 for i in children}
+    try:
+        while True:
+            time.sleep(1)
+            for i, child in children.items():
+                code = child.poll()
+                if code is None:
+                    continue
+                logging.warning(
+                    f"Shards {groups[i]} exited with {code}, "
+                    f"restarting in {backoff[i]:.0f}s"
+                )
+                time.sleep(backoff[i])
+                backoff[i] = min(backoff[i] * 2, 60)
+                children[i] = spawn(groups[i], args.shards)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for child in children.values():
+            child.terminate()
+        for child in children.values():
+            child.wait()
+
+
+if __name__ == "__main__":
+    main()
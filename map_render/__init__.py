@@ -1,3 +1,4 @@
-__all__ = ("render",)
+__all__ = ("render", "pool", "cache", "optimizer", "RenderResult")
 
-from .async_render import render
+from .async_render import render, pool, optimizer, RenderResult
+from .cache import cache
@@ -1,5 +1,21 @@
 import asyncio
-from concurrent.futures import ProcessPoolExecutor
+import logging
+import os
+import signal
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from os import getenv
+from traceback import format_exc
+from typing import NamedTuple, Optional
+
+from .optimize import Optimizer
+
+
+class RenderResult(NamedTuple):
+    image: Optional[bytes]
+    error: Optional[str]
+    # image came from FALLBACK_URL because rendering failed
+    fallback: bool = False
 
 
 def _render():
@@ -8,8 +24,240 @@ def _render():
     return get_img()
 
 
-_executor = ProcessPoolExecutor(1)
+def _check():
+    from .map_render import check_driver
+
+    return check_driver()
+
+
+def _quit():
+    from .map_render import quit_driver
+
+    quit_driver()
+
+
+def _init_worker():
+    # chromedriver and Chrome inherit the group, so that killing the group
+    # doesn't orphan them
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()
+
+
+class _Worker:
+    def __init__(self):
+        self.executor = ProcessPoolExecutor(1, initializer=_init_worker)
+
+    def _kill(self):
+        for process in list(self.executor._processes.values()):
+            try:
+                if hasattr(os, "killpg"):
+                    os.killpg(process.pid, signal.SIGKILL)
+                else:
+                    process.kill()
+            except ProcessLookupError:
+                pass
+
+    def restart(self):
+        # a hung browser never returns, so the process has to be killed
+        self._kill()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = ProcessPoolExecutor(1, initializer=_init_worker)
+
+    async def close(self, timeout: float):
+        if self.executor._processes:
+            try:
+                await asyncio.wait_for(
+                    asyncio.get_running_loop().run_in_executor(self.executor, _quit),
+                    timeout,
+                )
+            except Exception as e:
+                logging.warning(f"Can't quit renderer: {e!r}")
+        self._kill()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, func, timeout: float):
+        try:
+            return await asyncio.wait_for(
+                asyncio.get_running_loop().run_in_executor(self.executor, func),
+                timeout,
+            )
+        except (asyncio.TimeoutError, BrokenProcessPool):
+            self.restart()
+            raise
+
+
+class RendererPool:
+    def __init__(
+        self,
+        size: int = 1,
+        timeout: float = 30,
+        queue_timeout: float = 30,
+        check_interval: float = 60,
+    ):
+        self.size = size
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.check_interval = check_interval
+        self._workers = [_Worker() for _ in range(size)]
+        self._idle: asyncio.Queue[_Worker] = asyncio.Queue()
+        for worker in self._workers:
+            self._idle.put_nowait(worker)
+        self._health_task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if not self._health_task:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    def update(self, states: dict[int, bool]):
+        # the browser renders upstream's map, it doesn't need our states
+        pass
+
+    async def close(self):
+        if self._health_task:
+            self._health_task.cancel()
+            self._health_task = None
+        await asyncio.gather(*(worker.close(self.timeout) for worker in self._workers))
+
+    async def render(self) -> RenderResult:
+        result = await self._render()
+        if not result.image or optimizer.passthrough:
+            return result
+        try:
+            image = await asyncio.get_running_loop().run_in_executor(
+                _encoder, optimizer.process, result.image
+            )
+        except Exception:
+            return RenderResult(None, format_exc())
+        return result._replace(image=image)
+
+    async def _render(self) -> RenderResult:
+        try:
+            worker = await asyncio.wait_for(self._idle.get(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            return RenderResult(None, "Timed out waiting for a free renderer")
+        try:
+            return RenderResult(*await worker.run(_render, self.timeout))
+        except asyncio.TimeoutError:
+            return RenderResult(None, f"Rendering timed out after {self.timeout}s")
+        except BrokenProcessPool as e:
+            return RenderResult(None, f"Renderer crashed: {e!r}")
+        except Exception:
+            return RenderResult(None, format_exc())
+        finally:
+            self._idle.put_nowait(worker)
+
+    async def check(self):
+        # checks (and warms up) every worker that is idle right now
+        for _ in range(self._idle.qsize()):
+            worker = self._idle.get_nowait()
+            try:
+                if not await worker.run(_check, self.timeout):
+                    logging.warning("Renderer health check failed")
+            except (asyncio.TimeoutError, BrokenProcessPool) as e:
+                logging.warning(f"Renderer restarted: {e!r}")
+            finally:
+                self._idle.put_nowait(worker)
+
+    async def _health_loop(self):
+        while True:
+            await self.check()
+            await asyncio.sleep(self.check_interval)
+
+
+class NativeBackend:
+    def __init__(self, geometry_path: Optional[str], width: int = 1000):
+        # incomplete: no oblast geometry ships with the bot, so this backend
+        # only works with a map supplied through MAP_GEOMETRY, see
+        # Geometry.from_svg for the format
+        if not geometry_path or not os.path.isfile(geometry_path):
+            raise RuntimeError(
+                f"MAP_BACKEND=native needs MAP_GEOMETRY to point to an SVG map "
+                f"with a data-id on every region path, got {geometry_path!r}"
+            )
+        self.geometry_path = geometry_path
+        self.width = width
+        self.states: dict[int, bool] = {}
+        self._renderer = None
+        # one thread, so the renderer is never used concurrently
+        self._executor = ThreadPoolExecutor(1)
+
+    def start(self):
+        warm_up = asyncio.get_running_loop().run_in_executor(
+            self._executor, self._get_renderer
+        )
+        warm_up.add_done_callback(self._warmed_up)
+
+    def _warmed_up(self, future: asyncio.Future):
+        if not future.cancelled() and future.exception():
+            logging.error(
+                f"Can't load map geometry from {self.geometry_path}, "
+                f"serving the fallback map: {future.exception()!r}"
+            )
+
+    def update(self, states: dict[int, bool]):
+        self.states.update(states)
+
+    async def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _get_renderer(self):
+        if not self._renderer:
+            from .native import Geometry, NativeRenderer
+
+            self._renderer = NativeRenderer(
+                Geometry.from_svg(self.geometry_path), self.width
+            )
+        return self._renderer
+
+    def _render(self, states: dict[int, bool]) -> bytes:
+        from PIL import Image
+
+        return optimizer.process(Image.fromarray(self._get_renderer().draw(states)))
+
+    async def render(self) -> RenderResult:
+        try:
+            return RenderResult(
+                await asyncio.get_running_loop().run_in_executor(
+                    self._executor, self._render, dict(self.states)
+                ),
+                None,
+            )
+        except Exception:
+            error = format_exc()
+        try:
+            return RenderResult(await _fetch_fallback(), error, True)
+        except Exception:
+            return RenderResult(None, error + format_exc())
+
+
+async def _fetch_fallback() -> bytes:
+    import aiohttp
+
+    from bot.api import BASE_URL
+
+    async with aiohttp.ClientSession() as session:
+        async with session.get(BASE_URL + "/map.png") as response:
+            response.raise_for_status()
+            return await response.read()
+
+
+optimizer = Optimizer(
+    format=getenv("MAP_FORMAT", "png"),
+    width=int(getenv("MAP_OUTPUT_WIDTH", 0)) or None,
+    colors=int(getenv("MAP_COLORS", 0)) or None,
+    compression=int(getenv("MAP_PNG_COMPRESSION", 6)),
+)
+_encoder = ThreadPoolExecutor(1)
+
+if getenv("MAP_BACKEND") == "native":
+    pool = NativeBackend(getenv("MAP_GEOMETRY"), width=int(getenv("MAP_WIDTH", 1000)))
+else:
+    pool = RendererPool(
+        size=int(getenv("MAP_WORKERS", 1)),
+        timeout=float(getenv("MAP_TIMEOUT", 30)),
+        queue_timeout=float(getenv("MAP_QUEUE_TIMEOUT", 30)),
+    )
 
 
-async def render():
-    return await asyncio.get_running_loop().run_in_executor(_executor, _render)
+async def render() -> RenderResult:
+    return await pool.render()
@@ -0,0 +1,69 @@
+import asyncio
+from os import getenv
+from time import monotonic
+from typing import Awaitable, Callable, Optional
+
+from .async_render import RenderResult, render
+
+
+class MapCache:
+    def __init__(self, render: Callable[[], Awaitable[RenderResult]], ttl: float):
+        self._render = render
+        self.ttl = ttl
+        self.generation = 0
+        self._result: Optional[RenderResult] = None
+        self._result_time = 0.0
+        self._inflight: Optional[asyncio.Future] = None
+        self._inflight_time = 0.0
+        self._url: Optional[tuple[RenderResult, str]] = None
+        self._upload_lock = asyncio.Lock()
+
+    def invalidate(self):
+        self.generation += 1
+        self._result = None
+        self._inflight = None
+        self._url = None
+
+    async def get(self, min_time: Optional[float] = None) -> RenderResult:
+        # min_time: monotonic time the render must have started at or after
+        if min_time is None:
+            min_time = monotonic() - self.ttl
+        if self._result and self._result_time >= min_time:
+            return self._result
+        if not self._inflight or self._inflight_time < min_time:
+            self._inflight_time = monotonic()
+            self._inflight = asyncio.ensure_future(
+                self._do_render(self.generation, self._inflight_time)
+            )
+        return await asyncio.shield(self._inflight)
+
+    async def _do_render(self, generation: int, started: float) -> RenderResult:
+        result = await self._render()
+        if generation == self.generation:
+            if self._inflight_time == started:
+                self._inflight = None
+            if result.image and not result.fallback and started >= self._result_time:
+                self._result = result
+                self._result_time = started
+        return result
+
+    async def get_url(
+        self,
+        upload: Callable[[bytes], Awaitable[str]],
+        min_time: Optional[float] = None,
+        result: Optional[RenderResult] = None,
+    ) -> tuple[RenderResult, Optional[str]]:
+        # result: an image the caller already got from get()
+        if result is None:
+            result = await self.get(min_time)
+        if not result.image:
+            return result, None
+        async with self._upload_lock:
+            if self._url and self._url[0] is result:
+                return result, self._url[1]
+            url = await upload(result.image)
+            self._url = (result, url)
+            return result, url
+
+
+cache = MapCache(render, ttl=float(getenv("MAP_CACHE_TTL", 60)))
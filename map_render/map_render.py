@@ -1,13 +1,17 @@
 from io import StringIO
 from traceback import print_exc
-from typing import Union, Tuple
+from typing import Optional, Union, Tuple
 
 import requests
 from selenium.webdriver import Chrome
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
-from selenium.common.exceptions import NoSuchElementException, TimeoutException
+from selenium.common.exceptions import (
+    NoSuchElementException,
+    TimeoutException,
+    WebDriverException,
+)
 
 from bot.api import BASE_URL
 
@@ -18,17 +22,50 @@ FALLBACK_URL = BASE_URL + "/map.png"
 options = Options()
 options.add_argument("--headless=new")
 options.add_argument("--disable-dev-shm-usage")
-try:
-    driver = Chrome(options=options)
-except Exception:
-    print_exc()
-    driver = None
-else:
-    driver.get(URL)
 
+driver: Optional[Chrome] = None
 _map = None
 
 
+def get_driver() -> Chrome:
+    global driver, _map
+    if driver:
+        try:
+            driver.current_url
+        except WebDriverException:
+            print_exc()
+            try:
+                driver.quit()
+            except Exception:
+                pass
+            driver = None
+    if not driver:
+        _map = None
+        driver = Chrome(options=options)
+        driver.get(URL)
+    return driver
+
+
+def quit_driver():
+    global driver, _map
+    if driver:
+        try:
+            driver.quit()
+        except Exception:
+            print_exc()
+        driver = None
+        _map = None
+
+
+def check_driver() -> bool:
+    try:
+        get_driver()
+    except Exception:
+        print_exc()
+        return False
+    return True
+
+
 def get_map(driver: Chrome):
     global _map
     if _map:
@@ -61,25 +98,30 @@ def get_map(driver: Chrome):
     return _map
 
 
-def get_img() -> Union[Tuple[bytes, None], Tuple[None, str]]:
+def _format_exc() -> str:
+    f = StringIO()
+    print_exc(file=f)
+    return f.getvalue()
+
+
+def get_img() -> Union[Tuple[bytes, Optional[str], bool], Tuple[None, str, bool]]:
     try:
-        try:
-            return get_map(driver).screenshot_as_png, None
-        except Exception:
-            r = requests.get(FALLBACK_URL)
-            r.raise_for_status()
-            return r.content, None
+        return get_map(get_driver()).screenshot_as_png, None, False
+    except Exception:
+        error = _format_exc()
+    try:
+        r = requests.get(FALLBACK_URL)
+        r.raise_for_status()
+        return r.content, error, True
     except Exception:
-        f = StringIO()
-        print_exc(file=f)
-        return None, f.getvalue()
+        return None, error + _format_exc(), False
 
 
 if __name__ == "__main__":
     from PIL import Image
     from io import BytesIO
 
-    img, error = get_img()
+    img, error, _ = get_img()
     if img:
         Image.open(BytesIO(img)).show()
     else:
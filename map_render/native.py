@@ -0,0 +1,246 @@
+import math
+import re
+import xml.etree.ElementTree as ET
+from io import BytesIO
+from typing import Iterator, Optional
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+
+BACKGROUND = (24, 26, 27)
+OUTLINE = (24, 26, 27)
+COLORS = {None: (92, 92, 92), False: (58, 121, 70), True: (209, 52, 56)}
+CURVE_STEPS = 8
+
+_TOKEN = re.compile(r"[MmLlHhVvCcSsQqTtAaZz]|[-+]?(?:\d*\.\d+|\d+\.?)(?:[eE][-+]?\d+)?")
+_ARGS = {
+    "M": 2, "L": 2, "H": 1, "V": 1, "C": 6, "S": 4, "Q": 4, "T": 2, "A": 7, "Z": 0
+}  # fmt: skip
+
+Point = tuple[float, float]
+
+
+def _bezier(points: list[Point], steps: int = CURVE_STEPS) -> Iterator[Point]:
+    for i in range(1, steps + 1):
+        t = i / steps
+        pts = points
+        while len(pts) > 1:
+            pts = [
+                (a[0] + (b[0] - a[0]) * t, a[1] + (b[1] - a[1]) * t)
+                for a, b in zip(pts, pts[1:])
+            ]
+        yield pts[0]
+
+
+def parse_path(d: str) -> list[list[Point]]:
+    # flattens SVG path data into polygons; arcs are approximated by chords
+    tokens = _TOKEN.findall(d)
+    polygons: list[list[Point]] = []
+    polygon: list[Point] = []
+    x = y = start_x = start_y = 0.0
+    ctrl: Optional[Point] = None
+    cmd = ""
+    i = 0
+    while i < len(tokens):
+        if tokens[i].isalpha():
+            cmd = tokens[i]
+            i += 1
+        elif cmd in ("M", "m"):
+            # coordinates after moveto are implicit linetos
+            cmd = "L" if cmd == "M" else "l"
+        upper = cmd.upper()
+        args = [float(t) for t in tokens[i : i + _ARGS[upper]]]
+        i += _ARGS[upper]
+        rel = cmd.islower()
+        dx, dy = (x, y) if rel else (0.0, 0.0)
+        last_ctrl, ctrl = ctrl, None
+        if upper == "Z":
+            if polygon:
+                polygons.append(polygon)
+            polygon = []
+            x, y = start_x, start_y
+            continue
+        if upper == "M":
+            if polygon:
+                polygons.append(polygon)
+            x, y = args[0] + dx, args[1] + dy
+            start_x, start_y = x, y
+            polygon = [(x, y)]
+            continue
+        if not polygon:
+            polygon = [(x, y)]
+        if upper == "L" or upper == "T" or upper == "A":
+            x, y = args[-2] + dx, args[-1] + dy
+            polygon.append((x, y))
+        elif upper == "H":
+            x = args[0] + dx
+            polygon.append((x, y))
+        elif upper == "V":
+            y = args[0] + dy
+            polygon.append((x, y))
+        else:
+            pts = [(args[j] + dx, args[j + 1] + dy) for j in range(0, len(args), 2)]
+            if upper == "S":
+                reflected = (
+                    (2 * x - last_ctrl[0], 2 * y - last_ctrl[1])
+                    if last_ctrl
+                    else (x, y)
+                )
+                pts.insert(0, reflected)
+            polygon.extend(_bezier([(x, y), *pts]))
+            if upper in ("C", "S"):
+                ctrl = pts[-2]
+            x, y = pts[-1]
+    if polygon:
+        polygons.append(polygon)
+    return [p for p in polygons if len(p) > 2]
+
+
+class Geometry:
+    def __init__(self, width: float, height: float, regions: dict[int, list]):
+        self.width = width
+        self.height = height
+        # region id -> polygons in document order
+        self.regions = regions
+
+    @classmethod
+    def from_svg(cls, path: str) -> "Geometry":
+        # the SVG needs a viewBox and one or more <path d="..." data-id="N">
+        # per region, N being the region id used by the alerts API; paths
+        # without data-id (borders, labels) are ignored
+        root = ET.parse(path).getroot()
+        x, y, width, height = (
+            float(v) for v in root.attrib["viewBox"].replace(",", " ").split()
+        )
+        regions: dict[int, list] = {}
+        for element in root.iter():
+            if element.tag.rsplit("}", 1)[-1] != "path":
+                continue
+            region_id = element.get("data-id")
+            if region_id is None:
+                continue
+            regions.setdefault(int(region_id), []).extend(
+                [(px - x, py - y) for px, py in polygon]
+                for polygon in parse_path(element.attrib["d"])
+            )
+        if not regions:
+            raise ValueError(f"{path} has no <path> elements with a data-id")
+        return cls(width, height, regions)
+
+
+class _Layer:
+    __slots__ = ("y0", "y1", "x0", "x1", "weight")
+
+    def __init__(self, y0: int, y1: int, x0: int, x1: int, weight: np.ndarray):
+        self.y0, self.y1, self.x0, self.x1 = y0, y1, x0, x1
+        # share of each pixel in the bounding box that shows this region
+        self.weight = weight
+
+    @property
+    def box(self) -> tuple[slice, slice]:
+        return slice(self.y0, self.y1), slice(self.x0, self.x1)
+
+
+class NativeRenderer:
+    def __init__(self, geometry: Geometry, width: int = 1000, supersample: int = 2):
+        self.geometry = geometry
+        self.width = width
+        self.height = round(width * geometry.height / geometry.width)
+        self.supersample = supersample
+        self.scale = width / geometry.width
+        self._layers: Optional[dict[int, _Layer]] = None
+        self._background: np.ndarray = None
+        self._outline: np.ndarray = None
+        self._fill: np.ndarray = None
+        self._frame: np.ndarray = None
+        self._colors: dict[int, tuple[int, int, int]] = {}
+
+    def _coverage(self, polygons: list, box: tuple[int, int, int, int], outline=False):
+        # rasterises at supersample resolution and box-filters down to coverage
+        y0, y1, x0, x1 = box
+        ss = self.supersample
+        scale = self.scale * ss
+        mask = Image.new("L", ((x1 - x0) * ss, (y1 - y0) * ss))
+        draw = ImageDraw.Draw(mask)
+        for polygon in polygons:
+            points = [(x * scale - x0 * ss, y * scale - y0 * ss) for x, y in polygon]
+            if outline:
+                draw.polygon(points, outline=255, width=ss)
+            else:
+                draw.polygon(points, fill=255)
+        if ss > 1:
+            mask = mask.resize((x1 - x0, y1 - y0), Image.BOX)
+        return np.asarray(mask, dtype=np.float32) / 255
+
+    def _prepare(self):
+        full = (0, self.height, 0, self.width)
+        self._background = np.ones((self.height, self.width), np.float32)
+        self._layers = {}
+        for region_id, polygons in self.geometry.regions.items():
+            xs = [x for polygon in polygons for x, _ in polygon]
+            ys = [y for polygon in polygons for _, y in polygon]
+            box = (
+                max(0, math.floor(min(ys) * self.scale) - 1),
+                min(self.height, math.ceil(max(ys) * self.scale) + 1),
+                max(0, math.floor(min(xs) * self.scale) - 1),
+                min(self.width, math.ceil(max(xs) * self.scale) + 1),
+            )
+            layer = _Layer(*box, self._coverage(polygons, box))
+            # regions drawn later cover earlier ones
+            uncovered = 1 - layer.weight
+            self._background[layer.box] *= uncovered
+            for other in self._layers.values():
+                y0, y1 = max(layer.y0, other.y0), min(layer.y1, other.y1)
+                x0, x1 = max(layer.x0, other.x0), min(layer.x1, other.x1)
+                if y0 < y1 and x0 < x1:
+                    other.weight[
+                        y0 - other.y0 : y1 - other.y0, x0 - other.x0 : x1 - other.x0
+                    ] *= uncovered[
+                        y0 - layer.y0 : y1 - layer.y0, x0 - layer.x0 : x1 - layer.x0
+                    ]
+            self._layers[region_id] = layer
+        self._outline = self._coverage(
+            [p for polygons in self.geometry.regions.values() for p in polygons],
+            full,
+            outline=True,
+        )[..., None]
+
+    def _compose(self, box: tuple[slice, slice]):
+        outline = self._outline[box]
+        self._frame[box] = (
+            self._fill[box] * (1 - outline) + np.asarray(OUTLINE) * outline + 0.5
+        )
+
+    def draw(self, states: dict[int, bool], incremental: bool = True) -> np.ndarray:
+        if self._layers is None:
+            self._prepare()
+        colors = {
+            region_id: COLORS[states.get(region_id)] for region_id in self._layers
+        }
+        if self._frame is None or not incremental:
+            self._fill = self._background[..., None] * np.asarray(
+                BACKGROUND, np.float32
+            )
+            for region_id, layer in self._layers.items():
+                self._fill[layer.box] += layer.weight[..., None] * np.asarray(
+                    colors[region_id], np.float32
+                )
+            self._frame = np.empty((self.height, self.width, 3), np.uint8)
+            self._compose((slice(None), slice(None)))
+        else:
+            for region_id, layer in self._layers.items():
+                if colors[region_id] == self._colors[region_id]:
+                    continue
+                delta = np.subtract(
+                    colors[region_id], self._colors[region_id], dtype=np.float32
+                )
+                self._fill[layer.box] += layer.weight[..., None] * delta
+                self._compose(layer.box)
+        self._colors = colors
+        return self._frame
+
+    def render(self, states: dict[int, bool], incremental: bool = True) -> bytes:
+        f = BytesIO()
+        Image.fromarray(self.draw(states, incremental)).save(f, "PNG")
+        return f.getvalue()
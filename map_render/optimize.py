@@ -0,0 +1,84 @@
+import logging
+from collections import OrderedDict
+from hashlib import blake2b
+from io import BytesIO
+from time import perf_counter
+from typing import TYPE_CHECKING, Optional, Union
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+
+class Optimizer:
+    def __init__(
+        self,
+        format: str = "png",
+        width: Optional[int] = None,
+        colors: Optional[int] = None,
+        compression: int = 6,
+        cache_size: int = 8,
+    ):
+        self.format = format.lower()
+        self.width = width
+        self.colors = colors
+        self.compression = compression
+        self.cache_size = cache_size
+        self._cache: OrderedDict[bytes, bytes] = OrderedDict()
+        # (encoded size in bytes, encode time in seconds) of the last encode
+        self.last: Optional[tuple[int, float]] = None
+
+    @property
+    def extension(self) -> str:
+        return self.format
+
+    @property
+    def passthrough(self) -> bool:
+        return self.format == "png" and not self.width and not self.colors
+
+    def process(self, image: Union[bytes, "Image.Image"]) -> bytes:
+        if isinstance(image, bytes):
+            if self.passthrough:
+                return image
+            key = blake2b(image, digest_size=16).digest()
+        else:
+            key = blake2b(image.tobytes(), digest_size=16).digest()
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        from PIL import Image
+
+        start = perf_counter()
+        data = self.encode(
+            Image.open(BytesIO(image)) if isinstance(image, bytes) else image
+        )
+        self.last = (len(data), perf_counter() - start)
+        logging.info(
+            f"Encoded map as {self.format}: {len(data)} bytes "
+            f"in {self.last[1] * 1000:.1f} ms"
+        )
+        self._cache[key] = data
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return data
+
+    def encode(self, image: "Image.Image") -> bytes:
+        from PIL import Image
+
+        if image.mode not in ("RGB", "P"):
+            image = image.convert("RGB")
+        if self.width and image.width > self.width:
+            image = image.resize(
+                (self.width, round(image.height * self.width / image.width)),
+                Image.LANCZOS,
+            )
+        if self.colors:
+            # the map only has a handful of colours plus anti-aliasing shades
+            image = image.quantize(
+                self.colors, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE
+            )
+        f = BytesIO()
+        if self.format == "webp":
+            image.save(f, "WEBP", lossless=True, method=0)
+        else:
+            image.save(f, "PNG", compress_level=self.compression)
+        return f.getvalue()